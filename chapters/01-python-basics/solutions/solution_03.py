@@ -2,6 +2,18 @@
 問題3の模範解答: 辞書操作
 """
 
+import bisect
+import itertools
+import math
+import random
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:  # NumPyがない環境では純Pythonの実装を使う
+    np = None
+
 
 def filter_products(products: list[dict], min_price: float, max_price: float) -> list[dict]:
     """
@@ -21,6 +33,219 @@ def filter_products(products: list[dict], min_price: float, max_price: float) ->
     ]
 
 
+class ProductCatalog:
+    """
+    価格順に並べた商品カタログ
+
+    同じカタログに何度も価格範囲で問い合わせる場合に使う。
+    価格の昇順リストを二分探索するので、範囲検索は O(log n + k log k)
+    （kは該当件数。結果をfilter_productsと同じ追加順に戻すためにソートする）。
+    """
+
+    def __init__(self, products: list[dict] | None = None):
+        """
+        カタログを初期化
+
+        Args:
+            products: 初期の商品リスト
+        """
+        self._sequence = itertools.count()  # 追加順を表す番号
+        self._prices: list[float] = []  # 二分探索用（価格の昇順）
+        self._entries: list[tuple[int, dict]] = []  # (追加順, 商品) を_pricesと同じ順で保持
+        if products:
+            entries = sorted(
+                ((product["price"], next(self._sequence), product) for product in products),
+                key=lambda entry: (entry[0], entry[1]),
+            )
+            self._prices = [price for price, _, _ in entries]
+            self._entries = [(sequence, product) for _, sequence, product in entries]
+
+    def __len__(self) -> int:
+        return len(self._prices)
+
+    def add(self, product: dict) -> None:
+        """
+        商品を追加
+
+        Args:
+            product: 商品 {"name": str, "price": float, "stock": int}
+        """
+        index = bisect.bisect_right(self._prices, product["price"])
+        self._prices.insert(index, product["price"])
+        self._entries.insert(index, (next(self._sequence), product))
+
+    def remove(self, product: dict) -> bool:
+        """
+        商品を削除（同じ辞書オブジェクトを探して削除する）
+
+        Args:
+            product: 削除する商品
+
+        Returns:
+            削除成功の場合True
+        """
+        start = bisect.bisect_left(self._prices, product["price"])
+        end = bisect.bisect_right(self._prices, product["price"])
+        for index in range(start, end):
+            if self._entries[index][1] is product:
+                del self._prices[index]
+                del self._entries[index]
+                return True
+        return False
+
+    def filter(self, min_price: float, max_price: float) -> list[dict]:
+        """
+        価格範囲内の商品を取得（filter_productsと同じ結果を返す）
+
+        Args:
+            min_price: 最低価格
+            max_price: 最高価格
+
+        Returns:
+            価格範囲内の商品リスト（追加順）
+        """
+        start = bisect.bisect_left(self._prices, min_price)
+        end = bisect.bisect_right(self._prices, max_price)
+        if start >= end:
+            return []
+        return [product for _, product in sorted(self._entries[start:end], key=lambda entry: entry[0])]
+
+
+class ProductColumns:
+    """
+    商品リストを列（価格・在庫）ごとの配列に変換して一括で絞り込む
+
+    大量の商品に対するバッチ集計向け。変換は最初の1回だけ行い、
+    NumPyがあれば範囲条件をベクトル化したブールマスクで評価する。
+    NumPyがない場合（またはuse_numpy=False）は純Pythonで同じ結果を返す。
+    """
+
+    def __init__(self, products: list[dict], use_numpy: bool | None = None):
+        """
+        Args:
+            products: 商品リスト [{"name": str, "price": float, "stock": int}, ...]
+            use_numpy: NumPyを使うかどうか（Noneならインストールされていれば使う）
+
+        Raises:
+            ImportError: use_numpy=TrueなのにNumPyがない場合
+        """
+        if use_numpy is None:
+            use_numpy = np is not None
+        elif use_numpy and np is None:
+            raise ImportError("use_numpy=True にはNumPyが必要です")
+        self.use_numpy = use_numpy
+        self.products = list(products)
+
+        if use_numpy:
+            count = len(self.products)
+            self._prices = np.fromiter((p["price"] for p in self.products), dtype=np.float64, count=count)
+            self._stocks = np.fromiter((p.get("stock", 0) for p in self.products), dtype=np.int64, count=count)
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+    def filter(self, min_price: float, max_price: float, in_stock: bool = False) -> list[dict]:
+        """
+        価格範囲内の商品を取得（filter_productsと同じ順序で返す）
+
+        Args:
+            min_price: 最低価格
+            max_price: 最高価格
+            in_stock: Trueなら在庫が1以上の商品だけに絞る
+
+        Returns:
+            条件を満たす商品リスト
+        """
+        products = self.products
+        if self.use_numpy:
+            mask = (self._prices >= min_price) & (self._prices <= max_price)
+            if in_stock:
+                mask &= self._stocks > 0
+            return [products[i] for i in np.flatnonzero(mask).tolist()]
+
+        # 純Pythonでは辞書を直接見る方が、別の配列とzipするより速い
+        if in_stock:
+            return [p for p in products if min_price <= p["price"] <= max_price and p.get("stock", 0) > 0]
+        return filter_products(products, min_price, max_price)
+
+
+def benchmark_columns(sizes: tuple = (100, 1_000, 10_000, 100_000, 1_000_000), queries: int = 20) -> None:
+    """
+    filter_productsと列形式（NumPy / 純Python）の範囲検索を件数別に比較
+
+    NumPyへの変換にはコストがかかるため、1回あたりの検索時間に加えて
+    変換コストの元が取れる検索回数（損益分岐点）も表示する。
+
+    Args:
+        sizes: 商品数
+        queries: 各件数での検索回数（価格帯の幅は全体の約1%）
+    """
+    print(f"\n=== ベンチマーク: 列形式での範囲検索（NumPy: {'あり' if np is not None else 'なし'}） ===")
+    header = f"  {'件数':>10} {'filter_products':>16} {'純Python':>12}"
+    if np is not None:
+        header += f" {'NumPy':>12} {'NumPy変換':>12} {'損益分岐':>8}"
+    print(header)
+    rng = random.Random(0)
+    for size in sizes:
+        products = [{"name": f"商品{i}", "price": rng.randint(100, 1_000_000), "stock": rng.randint(0, 100)}
+                    for i in range(size)]
+        ranges = [(low, low + 10_000) for low in (rng.randint(100, 990_000) for _ in range(queries))]
+
+        def per_query(func) -> float:
+            start = time.perf_counter()
+            for low, high in ranges:
+                func(low, high)
+            return (time.perf_counter() - start) / queries
+
+        scan = per_query(lambda low, high: filter_products(products, low, high))
+        python_columns = ProductColumns(products, use_numpy=False)
+        python_query = per_query(python_columns.filter)
+        row = f"  {size:>10,} {scan * 1e6:>14.1f}µs {python_query * 1e6:>10.1f}µs"
+        if np is not None:
+            start = time.perf_counter()
+            numpy_columns = ProductColumns(products, use_numpy=True)
+            build = time.perf_counter() - start
+            numpy_query = per_query(numpy_columns.filter)
+            row += f" {numpy_query * 1e6:>10.1f}µs {build * 1e6:>10.1f}µs"
+            if numpy_query < scan:
+                row += f" {math.ceil(build / (scan - numpy_query)):>7,}回"
+            else:
+                row += f" {'なし':>7}"
+        print(row)
+
+
+def benchmark_catalog(size: int = 100_000, queries: int = 1_000) -> None:
+    """
+    filter_productsとProductCatalog.filterの範囲検索を比較
+
+    Args:
+        size: 商品数
+        queries: 検索回数（価格帯の幅は全体の約0.1%）
+    """
+    rng = random.Random(0)
+    products = [{"name": f"商品{i}", "price": rng.randint(100, 1_000_000), "stock": rng.randint(0, 100)}
+                for i in range(size)]
+    ranges = [(low, low + 1_000) for low in (rng.randint(100, 999_000) for _ in range(queries))]
+
+    start = time.perf_counter()
+    catalog = ProductCatalog(products)
+    build_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expected = [filter_products(products, low, high) for low, high in ranges]
+    scan_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = [catalog.filter(low, high) for low, high in ranges]
+    catalog_elapsed = time.perf_counter() - start
+    assert actual == expected
+
+    print(f"\n=== ベンチマーク: 価格範囲の検索（{size:,}件 × {queries:,}回） ===")
+    print(f"  カタログの構築: {build_elapsed * 1e3:.1f}ms")
+    print(f"  filter_products : {scan_elapsed / queries * 1e6:9.1f}µs/回")
+    print(f"  ProductCatalog  : {catalog_elapsed / queries * 1e6:9.1f}µs/回")
+
+
 # テストコード
 if __name__ == "__main__":
     # テストデータ
@@ -57,4 +282,30 @@ if __name__ == "__main__":
     print(f"  結果: {result3}")
     assert len(result3) == 0
 
+    # テストケース4: ProductCatalogはfilter_productsと同じ結果を返す
+    catalog = ProductCatalog(products)
+    for low, high in [(1000, 30000), (10000, 100000), (100000, 200000), (680, 680), (0, 10**9)]:
+        assert catalog.filter(low, high) == filter_products(products, low, high)
+    new_product = {"name": "Webカメラ", "price": 8900, "stock": 10}
+    catalog.add(new_product)
+    assert catalog.filter(8000, 9000) == filter_products(products + [new_product], 8000, 9000)
+    assert catalog.remove(products[2])
+    assert not catalog.remove({"name": "キーボード", "price": 8900, "stock": 30})  # 別オブジェクト
+    assert catalog.filter(8000, 9000) == [new_product]
+    assert len(catalog) == len(products)
+
+    # テストケース5: 列形式（NumPyがあれば両方の実装）でも同じ結果になる
+    modes = [False, True] if np is not None else [False]
+    for use_numpy in modes:
+        columns = ProductColumns(products, use_numpy=use_numpy)
+        for low, high in [(1000, 30000), (10000, 100000), (100000, 200000), (680, 680)]:
+            assert columns.filter(low, high) == filter_products(products, low, high)
+        in_stock = ProductColumns(products + [{"name": "品切れ", "price": 2000, "stock": 0}], use_numpy=use_numpy)
+        assert [p["name"] for p in in_stock.filter(1000, 3000, in_stock=True)] == ["マウス"]
+
     print("\n全てのテストが成功しました！")
+
+    # ベンチマーク: python solution_03.py --bench
+    if "--bench" in sys.argv:
+        benchmark_catalog()
+        benchmark_columns()
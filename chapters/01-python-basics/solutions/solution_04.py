@@ -2,7 +2,15 @@
 問題4の模範解答: デコレータの実装
 """
 
+import asyncio
+import inspect
+import sys
+import threading
+import time
+import timeit
+from collections import OrderedDict, defaultdict
 from functools import wraps
+from typing import Hashable, NamedTuple
 
 
 def count_calls(func):
@@ -17,6 +25,431 @@ def count_calls(func):
     return wrapper
 
 
+class _ThreadCounter:
+    """スレッドごとの集計値（そのスレッドだけが書き込むのでロック不要）"""
+
+    __slots__ = ("calls", "sampled", "buckets")
+
+    def __init__(self):
+        self.calls = 0
+        self.sampled = 0
+        # 実行時間（ナノ秒）のビット長ごとの件数: buckets[b] は 2**(b-1) <= t < 2**b
+        self.buckets = [0] * 65
+
+
+class CallStats:
+    """
+    profile_callsで集めた関数の統計
+
+    各スレッドは自分専用の_ThreadCounterに書き込み、読み出し時に合計する。
+    書き込みにロックを使わないのでスレッドセーフかつ低コストになる。
+    """
+
+    def __init__(self, sample_every: int):
+        self.sample_every = sample_every
+        self._local = threading.local()
+        self._counters: list[_ThreadCounter] = []
+        self._lock = threading.Lock()  # スレッドの初回登録時だけ使う
+
+    def _counter(self) -> _ThreadCounter:
+        """このスレッドの集計値を取得（初回は登録する）"""
+        try:
+            return self._local.counter
+        except AttributeError:
+            counter = self._local.counter = _ThreadCounter()
+            with self._lock:
+                self._counters.append(counter)
+            return counter
+
+    @property
+    def call_count(self) -> int:
+        """全スレッドの実行回数の合計"""
+        return sum(counter.calls for counter in self._counters)
+
+    @property
+    def sampled_count(self) -> int:
+        """実行時間を計測した回数"""
+        return sum(counter.sampled for counter in self._counters)
+
+    def histogram(self) -> list[int]:
+        """実行時間のヒストグラム（ナノ秒のビット長ごとの件数）"""
+        merged = [0] * 65
+        for counter in self._counters:
+            for bucket, count in enumerate(counter.buckets):
+                merged[bucket] += count
+        return merged
+
+    def percentile(self, p: float) -> float:
+        """
+        実行時間のパーセンタイルを推定（秒）
+
+        ヒストグラムの区間の上限を返すので、最大で2倍の誤差がある
+
+        Args:
+            p: 0〜100のパーセンタイル
+        """
+        histogram = self.histogram()
+        total = sum(histogram)
+        if total == 0:
+            return 0.0
+        threshold = total * p / 100
+        seen = 0
+        for bucket, count in enumerate(histogram):
+            seen += count
+            if count and seen >= threshold:
+                return (1 << bucket) / 1e9
+        return (1 << 64) / 1e9
+
+    def reset(self) -> None:
+        """集計値をゼロに戻す"""
+        for counter in self._counters:
+            counter.calls = counter.sampled = 0
+            counter.buckets = [0] * 65
+
+
+def profile_calls(func=None, *, timing: bool = False, sample_every: int = 1):
+    """
+    スレッドセーフな実行回数カウンター兼プロファイラーのデコレータ
+
+    count_callsと違い、カウンターはスレッドごとに持ち、読み出し時に合計する。
+    timing=Trueの場合は実行時間のヒストグラムも記録する。
+    計測のコスト（perf_counter_nsの呼び出し）はsample_every回に1回だけかかる。
+    統計は wrapper.stats（CallStats）で参照する。
+
+    使用例:
+        @profile_calls(timing=True, sample_every=100)
+        def handler(): ...
+
+        handler.stats.call_count
+        handler.stats.percentile(99)
+
+    Args:
+        func: デコレートする関数（引数付きで使う場合はNone）
+        timing: 実行時間を記録するかどうか
+        sample_every: 何回に1回実行時間を計測するか
+    """
+    if func is None:
+        return lambda f: profile_calls(f, timing=timing, sample_every=sample_every)
+    if sample_every < 1:
+        raise ValueError("sample_every は1以上にしてください")
+
+    stats = CallStats(sample_every)
+    local = stats._local
+    get_counter = stats._counter
+    clock = time.perf_counter_ns
+
+    # モードごとに分岐のない関数を作り、呼び出しごとの処理を最小にする
+    # （スレッドの初回以外はget_counter()を呼ばずにthreading.localから直接読む）
+    if not timing:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                local.counter.calls += 1
+            except AttributeError:
+                get_counter().calls += 1
+            return func(*args, **kwargs)
+    else:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                counter = local.counter
+            except AttributeError:
+                counter = get_counter()
+            counter.calls += 1
+            if counter.calls % sample_every:
+                return func(*args, **kwargs)
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                counter.sampled += 1
+                counter.buckets[(clock() - start).bit_length()] += 1
+
+    wrapper.stats = stats
+    return wrapper
+
+
+class LRUPolicy:
+    """最も長く使われていないキーを追い出す"""
+
+    def __init__(self):
+        self._order: OrderedDict = OrderedDict()
+
+    def on_insert(self, key: Hashable) -> None:
+        self._order[key] = None
+
+    def on_access(self, key: Hashable) -> None:
+        self._order.move_to_end(key)
+
+    def on_remove(self, key: Hashable) -> None:
+        del self._order[key]
+
+    def victim(self) -> Hashable:
+        return next(iter(self._order))
+
+
+class LFUPolicy:
+    """
+    使用回数が最も少ないキーを追い出す（同数なら古い方）
+
+    使用回数ごとの挿入順辞書と最小回数を持つので、アクセスと追い出しはO(1)
+    """
+
+    def __init__(self):
+        self._freq: dict = {}
+        self._buckets: defaultdict = defaultdict(OrderedDict)
+        self._min_freq = 0
+
+    def on_insert(self, key: Hashable) -> None:
+        self._freq[key] = 1
+        self._buckets[1][key] = None
+        self._min_freq = 1
+
+    def on_access(self, key: Hashable) -> None:
+        freq = self._freq[key]
+        bucket = self._buckets[freq]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[freq]
+            if self._min_freq == freq:
+                self._min_freq = freq + 1
+        self._freq[key] = freq + 1
+        self._buckets[freq + 1][key] = None
+
+    def on_remove(self, key: Hashable) -> None:
+        freq = self._freq.pop(key)
+        bucket = self._buckets[freq]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[freq]
+            if self._min_freq == freq and self._freq:
+                self._min_freq = min(self._buckets)
+
+    def victim(self) -> Hashable:
+        return next(iter(self._buckets[self._min_freq]))
+
+
+_POLICIES = {"lru": LRUPolicy, "lfu": LFUPolicy}
+
+
+class CacheInfo(NamedTuple):
+    """memoizeのキャッシュの統計"""
+    hits: int
+    misses: int
+    evictions: int
+    expirations: int
+    currsize: int
+    maxsize: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class _Flight:
+    """同期関数で計算中のキーを待つための情報"""
+
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error: BaseException | None = None
+
+
+_KWARGS_MARK = object()  # 位置引数とキーワード引数の区切り
+_MISSING = object()  # キャッシュに値がないことを表す
+_RETRY = object()  # 計算役の呼び出しがキャンセルされたので、待っていた側がやり直す
+
+
+def memoize(func=None, *, maxsize: int = 128, ttl: float | None = None, policy="lru"):
+    """
+    結果をキャッシュするデコレータ（同期関数・async関数の両方に対応）
+
+    functools.lru_cacheとの違い:
+    - エントリごとの有効期限（ttl秒）
+    - 追い出し方式を選べる（"lru" / "lfu" / on_insert・on_access・on_remove・victimを持つオブジェクトのクラス）
+    - 同じ引数の呼び出しが同時に来たら計算は1回だけ行い、結果を共有する（single-flight）
+    - ヒット・ミス・追い出し・期限切れの回数を cache_info() で取得できる
+
+    例外はキャッシュせず、待っていた呼び出しにもそのまま送出する。
+
+    使用例:
+        @memoize(maxsize=1024, ttl=60, policy="lfu")
+        async def fetch_rate(currency: str) -> float: ...
+
+    Args:
+        func: デコレートする関数（引数付きで使う場合はNone）
+        maxsize: キャッシュする最大件数
+        ttl: 有効期限（秒、Noneなら無期限）
+        policy: 追い出し方式
+    """
+    if func is None:
+        return lambda f: memoize(f, maxsize=maxsize, ttl=ttl, policy=policy)
+    if maxsize < 1:
+        raise ValueError("maxsize は1以上にしてください")
+
+    policy_obj = _POLICIES[policy]() if isinstance(policy, str) else policy()
+    entries: dict = {}  # キー → (値, 期限)
+    in_flight: dict = {}  # キー → 計算中の_Flight / asyncio.Future
+    lock = threading.Lock()
+    counts = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+    clock = time.monotonic
+
+    def make_key(args, kwargs):
+        if kwargs:
+            return args + (_KWARGS_MARK,) + tuple(kwargs.items())
+        return args
+
+    def lookup(key):
+        """キャッシュを引く（lockを取った状態で呼ぶ）。見つからなければ_MISSINGを返す"""
+        entry = entries.get(key)
+        if entry is None:
+            return _MISSING
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= clock():
+            del entries[key]
+            policy_obj.on_remove(key)
+            counts["expirations"] += 1
+            return _MISSING
+        policy_obj.on_access(key)
+        counts["hits"] += 1
+        return value
+
+    def store(key, value) -> None:
+        """計算結果を保存（lockを取った状態で呼ぶ）"""
+        if key in entries:
+            policy_obj.on_remove(key)
+        elif len(entries) >= maxsize:
+            victim = policy_obj.victim()
+            del entries[victim]
+            policy_obj.on_remove(victim)
+            counts["evictions"] += 1
+        entries[key] = (value, None if ttl is None else clock() + ttl)
+        policy_obj.on_insert(key)
+
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = make_key(args, kwargs)
+            while True:
+                with lock:
+                    value = lookup(key)
+                    if value is not _MISSING:
+                        return value
+                    future = in_flight.get(key)
+                    leader = future is None
+                    if leader:
+                        counts["misses"] += 1
+                        future = in_flight[key] = asyncio.get_running_loop().create_future()
+                if not leader:
+                    # 先に来た呼び出しの結果を待つ（自分がキャンセルされても計算は止めない）
+                    value = await asyncio.shield(future)
+                    if value is _RETRY:
+                        continue  # 計算役がキャンセルされたので、誰かが計算役を引き継ぐ
+                    with lock:
+                        counts["hits"] += 1
+                    return value
+                break
+            try:
+                value = await func(*args, **kwargs)
+            except BaseException as error:
+                with lock:
+                    del in_flight[key]
+                if isinstance(error, asyncio.CancelledError):
+                    # 1つの呼び出しのキャンセルを、待っている他の呼び出しに広げない
+                    future.set_result(_RETRY)
+                else:
+                    future.set_exception(error)
+                    future.exception()  # 待つ側がいなくても警告を出さない
+                raise
+            with lock:
+                del in_flight[key]
+                store(key, value)
+            future.set_result(value)
+            return value
+    else:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = make_key(args, kwargs)
+            with lock:
+                value = lookup(key)
+                if value is not _MISSING:
+                    return value
+                flight = in_flight.get(key)
+                leader = flight is None
+                if leader:
+                    counts["misses"] += 1
+                    flight = in_flight[key] = _Flight()
+            if not leader:
+                flight.event.wait()
+                if flight.error is not None:
+                    raise flight.error
+                # 計算が成功したときだけヒットとして数える（非同期版と同じ）
+                with lock:
+                    counts["hits"] += 1
+                return flight.value
+            try:
+                flight.value = value = func(*args, **kwargs)
+            except BaseException as error:
+                flight.error = error
+                raise
+            else:
+                with lock:
+                    store(key, value)
+            finally:
+                with lock:
+                    del in_flight[key]
+                flight.event.set()
+            return value
+
+    def cache_info() -> CacheInfo:
+        with lock:
+            return CacheInfo(counts["hits"], counts["misses"], counts["evictions"],
+                             counts["expirations"], len(entries), maxsize)
+
+    def cache_clear() -> None:
+        with lock:
+            for key in list(entries):
+                policy_obj.on_remove(key)
+            entries.clear()
+            for name in counts:
+                counts[name] = 0
+
+    wrapper.cache_info = cache_info
+    wrapper.cache_clear = cache_clear
+    return wrapper
+
+
+def benchmark_call_overhead(number: int = 1_000_000) -> None:
+    """
+    デコレータごとの1回あたりの呼び出しオーバーヘッドを計測
+
+    Args:
+        number: 呼び出し回数
+    """
+
+    def noop():
+        return None
+
+    variants = [
+        ("デコレータなし", noop),
+        ("count_calls", count_calls(noop)),
+        ("profile_calls", profile_calls(noop)),
+        ("profile_calls(timing)", profile_calls(noop, timing=True)),
+        ("profile_calls(timing, 1/100)", profile_calls(noop, timing=True, sample_every=100)),
+        ("memoize（ヒット）", memoize(noop)),
+    ]
+    print(f"\n=== ベンチマーク: 呼び出しオーバーヘッド（{number:,}回） ===")
+    baseline = None
+    for name, func in variants:
+        per_call = min(timeit.repeat(func, number=number, repeat=3)) / number
+        if baseline is None:
+            baseline = per_call
+        print(f"  {name:<30}: {per_call * 1e9:6.1f}ns/回（+{(per_call - baseline) * 1e9:5.1f}ns）")
+
+
 # テストコード
 if __name__ == "__main__":
 
@@ -61,4 +494,116 @@ if __name__ == "__main__":
     assert say_hello.call_count == 3
     assert greet.call_count == 2
 
+    # テスト4: 複数スレッドから呼んでも回数が失われない
+    print("\n=== テスト4: profile_calls ===")
+
+    @profile_calls(timing=True, sample_every=10)
+    def work(x: int) -> int:
+        return x * 2
+
+    def call_many():
+        for i in range(10_000):
+            work(i)
+
+    threads = [threading.Thread(target=call_many) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"work の実行回数: {work.stats.call_count}（計測 {work.stats.sampled_count}回）")
+    print(f"work の実行時間 p50: {work.stats.percentile(50) * 1e6:.2f}µs, p99: {work.stats.percentile(99) * 1e6:.2f}µs")
+    assert work.stats.call_count == 80_000
+    assert work.stats.sampled_count == 8_000 == sum(work.stats.histogram())
+    assert work(21) == 42 and work.__name__ == "work"
+    work.stats.reset()
+    assert work.stats.call_count == 0
+
+    # テスト5: memoize
+    print("\n=== テスト5: memoize ===")
+    computed = []
+
+    @memoize(maxsize=2, policy="lfu")
+    def square(x: int) -> int:
+        computed.append(x)
+        return x * x
+
+    assert [square(2), square(2), square(3), square(4)] == [4, 4, 9, 16]
+    assert square(2) == 4 and computed == [2, 3, 4]  # 使用回数の少ない3が追い出された
+    square(3)
+    assert computed == [2, 3, 4, 3]
+    info = square.cache_info()
+    print(f"square: {info}（ヒット率 {info.hit_rate:.0%}）")
+    assert (info.hits, info.misses, info.evictions, info.currsize) == (2, 4, 2, 2)
+
+    @memoize(maxsize=2, policy="lru", ttl=0.05)
+    def lru_square(x: int) -> int:
+        computed.append(-x)
+        return x * x
+
+    computed.clear()
+    lru_square(1), lru_square(2), lru_square(1), lru_square(3)  # 最も古く使われた2が追い出される
+    lru_square(1)
+    assert computed == [-1, -2, -3]
+    time.sleep(0.06)
+    lru_square(1)
+    assert computed == [-1, -2, -3, -1] and lru_square.cache_info().expirations == 1
+
+    # 同じ引数の同時呼び出しは1回だけ計算する（同期・非同期）
+    slow_calls = []
+
+    @memoize
+    def slow_sync(x: int) -> int:
+        slow_calls.append(x)
+        time.sleep(0.05)
+        if x < 0:
+            raise ValueError("負の数")
+        return x
+
+    def call_slow_sync(x: int) -> None:
+        try:
+            slow_sync(x)
+        except ValueError:
+            pass
+
+    for x in (1, -1):
+        threads = [threading.Thread(target=call_slow_sync, args=(x,)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert slow_calls == [1, -1]
+    # 失敗した計算を待っていた呼び出しはヒットに数えない
+    assert (slow_sync.cache_info().hits, slow_sync.cache_info().misses) == (7, 2)
+
+    @memoize(ttl=60)
+    async def slow_async(x: int) -> int:
+        slow_calls.append(x)
+        await asyncio.sleep(0.05)
+        if x < 0:
+            raise ValueError("負の数")
+        return x
+
+    async def run_async_tests():
+        results = await asyncio.gather(*(slow_async(2) for _ in range(8)))
+        assert results == [2] * 8
+        errors = await asyncio.gather(*(slow_async(-1) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(e, ValueError) for e in errors)
+
+        # 計算役の呼び出しがキャンセルされても、待っている他の呼び出しは結果を受け取れる
+        leader = asyncio.create_task(slow_async(3))
+        await asyncio.sleep(0.01)
+        followers = [asyncio.create_task(slow_async(3)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        assert await asyncio.gather(*followers) == [3, 3, 3]
+        assert leader.cancelled()
+
+    asyncio.run(run_async_tests())
+    assert slow_calls == [1, -1, 2, -1, 3, 3]
+    print(f"slow_async: {slow_async.cache_info()}")
+
     print("\n全てのテストが成功しました！")
+
+    # ベンチマーク: python solution_04.py --bench
+    if "--bench" in sys.argv:
+        benchmark_call_overhead()
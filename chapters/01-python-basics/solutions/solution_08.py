@@ -2,7 +2,16 @@
 問題8の模範解答: コンテキストマネージャー
 """
 
-from contextlib import contextmanager
+from collections import defaultdict, deque
+from contextlib import contextmanager, redirect_stdout
+from contextvars import ContextVar
+from functools import wraps
+import asyncio
+import inspect
+import io
+import json
+import sys
+import threading
 import time
 
 
@@ -21,11 +30,12 @@ def timer(name: str):
 
     出力例: "処理A: 1.00秒"
     """
-    start_time = time.time()
+    # time.time()は時刻合わせで前後するので、経過時間は単調増加のperf_counterで測る
+    start_time = time.perf_counter()
     try:
         yield
     finally:
-        end_time = time.time()
+        end_time = time.perf_counter()
         elapsed_time = end_time - start_time
         print(f"{name}: {elapsed_time:.2f}秒")
 
@@ -40,11 +50,11 @@ class Timer:
         self.elapsed_time = None
 
     def __enter__(self):
-        self.start_time = time.time()
+        self.start_time = time.perf_counter()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        end_time = time.time()
+        end_time = time.perf_counter()
         self.elapsed_time = end_time - self.start_time
         print(f"{self.name}: {self.elapsed_time:.2f}秒")
         return False  # 例外を再送出する
@@ -54,6 +64,341 @@ class Timer:
         return self.elapsed_time if self.elapsed_time is not None else 0.0
 
 
+class LatencyHistogram:
+    """
+    計測値（ナノ秒）を集計するストリーミングヒストグラム（HDR Histogram方式）
+
+    値を2のべき乗の区間に分け、各区間をさらに2**(SUB_BITS-1)個に等分して数える。
+    記録はO(1)、メモリは値の桁数に比例する分だけで、
+    パーセンタイルの相対誤差は 1/2**(SUB_BITS-1) 以下になる。
+    """
+
+    SUB_BITS = 7  # 相対誤差 1/64 以下
+
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.counts: dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.min: int | None = None
+        self.max: int | None = None
+
+    def record(self, value: int) -> None:
+        """
+        値を1件記録
+
+        Args:
+            value: 計測値（ナノ秒、0以上の整数）
+        """
+        shift = value.bit_length() - self.SUB_BITS
+        if shift < 0:
+            shift = 0
+        index = (shift << self.SUB_BITS) | (value >> shift)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def _bucket_value(self, index: int) -> int:
+        """区間の代表値（中央値）"""
+        shift = index >> self.SUB_BITS
+        mantissa = index & ((1 << self.SUB_BITS) - 1)
+        return (mantissa << shift) + ((1 << shift) >> 1)
+
+    def percentile(self, p: float) -> int:
+        """
+        パーセンタイルを推定（ナノ秒）
+
+        Args:
+            p: 0〜100のパーセンタイル
+        """
+        if self.count == 0:
+            return 0
+        threshold = max(1, self.count * p / 100)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= threshold:
+                # 区間の代表値が実測の範囲外にならないようにする
+                return min(max(self._bucket_value(index), self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class TimerRegistry:
+    """
+    名前ごとに計測値を集計するタイマー
+
+    perf_counter_nsで計測し、毎回printする代わりにLatencyHistogramへ記録する。
+    report()でまとめて件数・平均・p50/p95/p99を表示する。
+    time(name)はwithでもasync withでも使える。
+    スレッドをまたいで同じレジストリに書き込む場合は集計値が不正確になりうる
+    （asyncioのタスク間での共有は問題ない）。
+
+    使用例:
+        timers = TimerRegistry()
+        for item in items:
+            with timers.time("処理"):
+                process(item)
+        print(timers.report())
+    """
+
+    def __init__(self):
+        self.histograms: dict[str, LatencyHistogram] = {}
+
+    def time(self, name: str) -> "_TimerContext":
+        """nameの計測を行うコンテキストマネージャーを返す"""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = LatencyHistogram()
+        return _TimerContext(histogram)
+
+    def record(self, name: str, elapsed_ns: int) -> None:
+        """計測済みの値を記録"""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = LatencyHistogram()
+        histogram.record(elapsed_ns)
+
+    def stats(self, name: str) -> dict:
+        """nameの集計結果（時間はすべて秒）"""
+        histogram = self.histograms[name]
+        return {
+            "count": histogram.count,
+            "mean": histogram.mean / 1e9,
+            "min": (histogram.min or 0) / 1e9,
+            "max": (histogram.max or 0) / 1e9,
+            "p50": histogram.percentile(50) / 1e9,
+            "p95": histogram.percentile(95) / 1e9,
+            "p99": histogram.percentile(99) / 1e9,
+        }
+
+    def report(self) -> str:
+        """全ての名前の集計結果を表にした文字列"""
+        lines = [f"{'名前':<20} {'件数':>8} {'平均':>10} {'p50':>10} {'p95':>10} {'p99':>10} {'最大':>10}"]
+        for name in self.histograms:
+            s = self.stats(name)
+            lines.append(
+                f"{name:<20} {s['count']:>8,} " + " ".join(
+                    f"{s[key] * 1e3:>8.3f}ms" for key in ("mean", "p50", "p95", "p99", "max")
+                )
+            )
+        return "\n".join(lines)
+
+
+class _TimerContext:
+    """TimerRegistry.time()が返すコンテキストマネージャー（1回の計測用）"""
+
+    __slots__ = ("_histogram", "_start")
+
+    def __init__(self, histogram: LatencyHistogram):
+        self._histogram = histogram
+        self._start = 0
+
+    def __enter__(self):
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._histogram.record(time.perf_counter_ns() - self._start)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return self.__exit__(exc_type, exc_val, exc_tb)
+
+
+# 実行中のスパン（asyncioのタスクにも引き継がれるのでawaitをまたいでも親子関係を保てる）
+_current_span: ContextVar["Span | None"] = ContextVar("current_span", default=None)
+
+
+class Span(Timer):
+    """
+    トレースの1区間（Timerを親子関係を持てるように拡張したもの）
+
+    Timerと違い終了時にprintはせず、Tracerに記録する。
+    with / async with のどちらでも使える。
+    """
+
+    def __init__(self, name: str, tracer: "Tracer"):
+        super().__init__(name)
+        self.tracer = tracer
+        self.parent: Span | None = None
+        self.children: list[Span] = []
+        self.start_ns = 0
+        self.end_ns = 0
+        self._token = None
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        self._token = _current_span.set(self)
+        self.start_ns = time.perf_counter_ns()
+        self.start_time = self.start_ns / 1e9
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.end_ns = time.perf_counter_ns()
+        self.elapsed_time = (self.end_ns - self.start_ns) / 1e9
+        _current_span.reset(self._token)
+        if self.parent is not None:
+            self.parent.children.append(self)
+        else:
+            self.tracer._finish(self)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return self.__exit__(exc_type, exc_val, exc_tb)
+
+    def walk(self, depth: int = 0):
+        """自分と子孫のスパンを (深さ, スパン) で順に返す"""
+        yield depth, self
+        for child in self.children:
+            yield from child.walk(depth + 1)
+
+
+class Tracer:
+    """
+    入れ子のスパンを記録し、完了したトレースを書き出す
+
+    ルート（親のない）スパンが終わるたびに1トレースとして最新max_traces件を保持する。
+    書き出し形式:
+    - Chrome trace event形式のJSON（chrome://tracing や Perfetto で表示）
+    - flame graph用のfolded stack形式（"親;子;孫 自分自身の時間(µs)"）
+
+    使用例:
+        tracer = Tracer()
+        async with tracer.span("リクエスト"):
+            with tracer.span("DB検索"):
+                ...
+        tracer.export_chrome_trace("trace.json")
+    """
+
+    def __init__(self, max_traces: int = 1000):
+        self.traces: deque[Span] = deque(maxlen=max_traces)
+        self._lock = threading.Lock()
+        self._epoch_ns = time.perf_counter_ns()
+
+    def span(self, name: str) -> Span:
+        """nameのスパンを作成（withで使う）"""
+        return Span(name, self)
+
+    def traced(self, name: str | None = None):
+        """
+        関数の実行全体をスパンにするデコレータ（同期関数・async関数の両方に対応）
+
+        Args:
+            name: スパン名（省略時は関数名）
+        """
+
+        def decorator(func):
+            span_name = name or func.__qualname__
+            if inspect.iscoroutinefunction(func):
+                @wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    async with self.span(span_name):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name):
+                    return func(*args, **kwargs)
+            return wrapper
+
+        return decorator
+
+    def _finish(self, root: Span) -> None:
+        with self._lock:
+            self.traces.append(root)
+
+    def _snapshot(self) -> list[Span]:
+        with self._lock:
+            return list(self.traces)
+
+    def chrome_trace(self) -> dict:
+        """Chrome trace event形式の辞書"""
+        events = []
+        for trace_id, root in enumerate(self._snapshot(), 1):
+            for _, span in root.walk():
+                events.append({
+                    "name": span.name,
+                    "ph": "X",
+                    "ts": (span.start_ns - self._epoch_ns) / 1e3,
+                    "dur": (span.end_ns - span.start_ns) / 1e3,
+                    "pid": 1,
+                    "tid": trace_id,  # トレースごとに別の行に表示する
+                })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def folded_stacks(self) -> str:
+        """folded stack形式の文字列（同じスタックは合計する）"""
+        totals: dict[str, int] = defaultdict(int)
+
+        def visit(span: Span, prefix: str) -> None:
+            stack = f"{prefix};{span.name}" if prefix else span.name
+            # 並行に実行された子の合計が親を超えることがあるので0未満にしない
+            self_ns = (span.end_ns - span.start_ns) - sum(c.end_ns - c.start_ns for c in span.children)
+            totals[stack] += max(self_ns, 0) // 1000
+            for child in span.children:
+                visit(child, stack)
+
+        for root in self._snapshot():
+            visit(root, "")
+        return "".join(f"{stack} {micros}\n" for stack, micros in totals.items())
+
+    def export_chrome_trace(self, path: str) -> None:
+        """Chrome trace event形式でファイルに書き出す"""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f, ensure_ascii=False)
+
+    def export_folded(self, path: str) -> None:
+        """folded stack形式でファイルに書き出す（flamegraph.pl / speedscopeで表示）"""
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.folded_stacks())
+
+    def clear(self) -> None:
+        """記録したトレースを消す"""
+        with self._lock:
+            self.traces.clear()
+
+
+def benchmark_timer_overhead(number: int = 100_000) -> None:
+    """
+    空のブロックを計測したときの1回あたりのコストを比較
+
+    Args:
+        number: 計測回数
+    """
+    registry = TimerRegistry()
+    variants = [
+        ("timer（print）", lambda: timer("空の処理")),
+        ("Timer（print）", lambda: Timer("空の処理")),
+        ("TimerRegistry.time", lambda: registry.time("空の処理")),
+    ]
+    print(f"\n=== ベンチマーク: タイマー1回あたりのコスト（{number:,}回） ===")
+    for name, make in variants:
+        # printの出力先は捨てる（端末に出す場合はさらに遅い）
+        with redirect_stdout(io.StringIO()):
+            start = time.perf_counter_ns()
+            for _ in range(number):
+                with make():
+                    pass
+            elapsed = time.perf_counter_ns() - start
+        print(f"  {name:<20}: {elapsed / number:8.0f}ns/回")
+
+
 # テストコード
 if __name__ == "__main__":
     print("=== タイマーコンテキストマネージャーのテスト ===\n")
@@ -100,4 +445,68 @@ if __name__ == "__main__":
     except ValueError as e:
         print(f"  例外をキャッチ: {e}")
 
+    # テスト6: 繰り返しの計測を集計する
+    print("\nテスト6: TimerRegistryで繰り返しの計測を集計")
+    timers = TimerRegistry()
+    for i in range(1000):
+        with timers.time("二乗の合計"):
+            sum(x * x for x in range(i))
+        timers.record("固定値", 1_000_000)
+
+    async def fetch(i: int) -> None:
+        async with timers.time("非同期処理"):
+            await asyncio.sleep(0.01 * (i % 3))
+
+    async def run_fetches():
+        await asyncio.gather(*(fetch(i) for i in range(30)))
+
+    asyncio.run(run_fetches())
+    print(timers.report())
+    stats = timers.stats("二乗の合計")
+    assert stats["count"] == 1000
+    assert stats["min"] <= stats["p50"] <= stats["p95"] <= stats["p99"] <= stats["max"]
+    assert timers.stats("固定値")["p99"] == 0.001
+    assert timers.stats("非同期処理")["count"] == 30
+    assert timers.stats("非同期処理")["p99"] >= 0.02
+
+    # ヒストグラムの誤差は1/64以下
+    histogram = LatencyHistogram()
+    for value in range(1, 100_001):
+        histogram.record(value)
+    for p in (50, 95, 99):
+        assert abs(histogram.percentile(p) - p * 1000) <= p * 1000 / 64
+
+    # テスト7: 入れ子のスパン（awaitをまたいでも親子関係が保たれる）
+    print("\nテスト7: Tracerで入れ子のスパンを記録")
+    tracer = Tracer()
+
+    @tracer.traced("DB検索")
+    async def query_db(i: int) -> int:
+        await asyncio.sleep(0.01)
+        return i
+
+    async def handle_request() -> None:
+        async with tracer.span("リクエスト"):
+            with tracer.span("認証"):
+                time.sleep(0.005)
+            await asyncio.gather(query_db(1), query_db(2))
+
+    asyncio.run(handle_request())
+    root = tracer.traces[-1]
+    for depth, span in root.walk():
+        print(f"  {'  ' * depth}{span.name}: {span.get_elapsed_time() * 1e3:.1f}ms")
+    assert [span.name for _, span in root.walk()] == ["リクエスト", "認証", "DB検索", "DB検索"]
+    assert all(child.parent is root for child in root.children)
+    assert _current_span.get() is None
+
+    events = tracer.chrome_trace()["traceEvents"]
+    assert len(events) == 4 and {e["ph"] for e in events} == {"X"}
+    folded = tracer.folded_stacks()
+    print("  folded stacks:\n" + "".join(f"    {line}\n" for line in folded.splitlines()))
+    assert {line.rsplit(" ", 1)[0] for line in folded.splitlines()} == {"リクエスト", "リクエスト;認証", "リクエスト;DB検索"}
+
     print("\n全てのテストが成功しました！")
+
+    # ベンチマーク: python solution_08.py --bench
+    if "--bench" in sys.argv:
+        benchmark_timer_overhead()
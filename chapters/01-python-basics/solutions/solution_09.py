@@ -2,7 +2,13 @@
 問題9の模範解答: 型ヒントを使った関数
 """
 
-from typing import Optional, List, Dict, Any
+import bisect
+import random
+import sys
+import time
+import tracemalloc
+from collections.abc import ItemsView, Mapping
+from typing import Optional, List, Dict, Any, Callable, Iterable, Iterator, Tuple
 
 
 def find_user_by_id(users: List[Dict[str, Any]], user_id: int) -> Optional[Dict[str, Any]]:
@@ -52,6 +58,214 @@ def merge_user_data(user: Dict[str, Any], updates: Dict[str, Any]) -> Dict[str,
     return merged
 
 
+class _Leaf:
+    """PersistentDictの葉（1つのキーと値）"""
+
+    __slots__ = ("hash", "key", "value")
+
+    def __init__(self, key_hash: int, key: Any, value: Any):
+        self.hash = key_hash
+        self.key = key
+        self.value = value
+
+
+class _Collision:
+    """PersistentDictの葉（ハッシュ値が完全に一致した複数のキー）"""
+
+    __slots__ = ("hash", "items")
+
+    def __init__(self, key_hash: int, items: Dict[Any, Any]):
+        self.hash = key_hash
+        self.items = items
+
+
+_BITS = 5
+_MASK = (1 << _BITS) - 1
+_HASH_MASK = (1 << 64) - 1
+
+
+def _trie_get(node: dict, key_hash: int, key: Any) -> Any:
+    shift = 0
+    while True:
+        child = node.get((key_hash >> shift) & _MASK)
+        if child is None:
+            raise KeyError(key)
+        if isinstance(child, dict):
+            node = child
+            shift += _BITS
+        elif isinstance(child, _Leaf):
+            if child.hash == key_hash and (child.key is key or child.key == key):
+                return child.value
+            raise KeyError(key)
+        else:
+            if child.hash == key_hash:
+                return child.items[key]
+            raise KeyError(key)
+
+
+def _trie_set(node: dict, shift: int, key_hash: int, key: Any, value: Any) -> Tuple[dict, bool]:
+    """
+    キーを設定した新しいノードを返す（元のノードは変更しない）
+
+    Returns:
+        (新しいノード, キーが新規に追加されたかどうか)
+    """
+    index = (key_hash >> shift) & _MASK
+    child = node.get(index)
+    if child is None:
+        new_child, added = _Leaf(key_hash, key, value), True
+    elif isinstance(child, dict):
+        new_child, added = _trie_set(child, shift + _BITS, key_hash, key, value)
+    elif child.hash != key_hash:
+        # ハッシュの次の5ビットで振り分ける下位ノードを作る
+        subtree = {(child.hash >> (shift + _BITS)) & _MASK: child}
+        new_child, added = _trie_set(subtree, shift + _BITS, key_hash, key, value)
+    elif isinstance(child, _Leaf):
+        if child.key is key or child.key == key:
+            new_child, added = _Leaf(key_hash, key, value), False
+        else:
+            new_child, added = _Collision(key_hash, {child.key: child.value, key: value}), True
+    else:
+        items = dict(child.items)
+        added = key not in items
+        items[key] = value
+        new_child = _Collision(key_hash, items)
+    new_node = dict(node)
+    new_node[index] = new_child
+    return new_node, added
+
+
+def _trie_delete(node: dict, shift: int, key_hash: int, key: Any) -> dict:
+    """キーを削除した新しいノードを返す（キーがなければKeyError）"""
+    index = (key_hash >> shift) & _MASK
+    child = node.get(index)
+    if child is None:
+        raise KeyError(key)
+    if isinstance(child, dict):
+        new_child = _trie_delete(child, shift + _BITS, key_hash, key)
+    elif child.hash != key_hash:
+        raise KeyError(key)
+    elif isinstance(child, _Leaf):
+        if not (child.key is key or child.key == key):
+            raise KeyError(key)
+        new_child = None
+    else:
+        items = dict(child.items)
+        del items[key]
+        if len(items) == 1:
+            (only_key, only_value), = items.items()
+            new_child = _Leaf(key_hash, only_key, only_value)
+        else:
+            new_child = _Collision(key_hash, items)
+    new_node = dict(node)
+    if new_child is None or new_child == {}:
+        del new_node[index]
+    else:
+        new_node[index] = new_child
+    return new_node
+
+
+def _trie_items(node: dict) -> Iterator[Tuple[Any, Any]]:
+    for child in node.values():
+        if isinstance(child, dict):
+            yield from _trie_items(child)
+        elif isinstance(child, _Leaf):
+            yield child.key, child.value
+        else:
+            yield from child.items.items()
+
+
+class _PersistentItemsView(ItemsView):
+    """PersistentDictのitems()（キーごとに検索し直さずトライを直接たどる）"""
+
+    def __iter__(self) -> Iterator[Tuple[Any, Any]]:
+        return _trie_items(self._mapping._root)
+
+
+class PersistentDict(Mapping):
+    """
+    変更できない（永続的な）辞書
+
+    ハッシュ値を5ビットずつ使う32分岐のトライ（HAMT）で保持する。
+    set / delete / merge は元の辞書を変更せずに新しい辞書を返し、
+    変更した経路のノードだけをコピーして残りは元の辞書と共有する。
+    そのため1キーの更新は全体のコピー（O(n)）ではなく O(log n) で済む。
+    キーの順序は挿入順ではない。
+    """
+
+    __slots__ = ("_root", "_len")
+
+    def __init__(self, data: Optional[Mapping] = None):
+        """
+        Args:
+            data: 初期データ
+        """
+        self._root: dict = {}
+        self._len = 0
+        if data:
+            for key, value in data.items():
+                self._root, added = _trie_set(self._root, 0, hash(key) & _HASH_MASK, key, value)
+                self._len += added
+
+    @classmethod
+    def _from_root(cls, root: dict, length: int) -> "PersistentDict":
+        result = cls.__new__(cls)
+        result._root = root
+        result._len = length
+        return result
+
+    def __getitem__(self, key: Any) -> Any:
+        return _trie_get(self._root, hash(key) & _HASH_MASK, key)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[Any]:
+        return (key for key, _ in _trie_items(self._root))
+
+    def items(self) -> ItemsView:
+        return _PersistentItemsView(self)
+
+    def set(self, key: Any, value: Any) -> "PersistentDict":
+        """キーに値を設定した新しい辞書を返す"""
+        root, added = _trie_set(self._root, 0, hash(key) & _HASH_MASK, key, value)
+        return self._from_root(root, self._len + added)
+
+    def delete(self, key: Any) -> "PersistentDict":
+        """キーを削除した新しい辞書を返す（キーがなければKeyError）"""
+        return self._from_root(_trie_delete(self._root, 0, hash(key) & _HASH_MASK, key), self._len - 1)
+
+    def merge(self, updates: Mapping) -> "PersistentDict":
+        """updatesの内容で更新した新しい辞書を返す（O(k log n)、kは更新するキーの数）"""
+        root, length = self._root, self._len
+        for key, value in updates.items():
+            root, added = _trie_set(root, 0, hash(key) & _HASH_MASK, key, value)
+            length += added
+        return self._from_root(root, length)
+
+    def __repr__(self) -> str:
+        return f"PersistentDict({dict(self.items())!r})"
+
+
+def merge_user_data_persistent(user: Mapping, updates: Mapping) -> PersistentDict:
+    """
+    merge_user_dataの永続辞書版（元のデータは変更しない）
+
+    userがPersistentDictなら構造を共有したまま更新するので、
+    大きなユーザーデータを何度も更新してもコピーのコストがかからない
+
+    Args:
+        user: 元のユーザーデータ（通常の辞書なら最初の1回だけ変換する）
+        updates: 更新データ
+
+    Returns:
+        マージされた新しいユーザーデータ
+    """
+    if not isinstance(user, PersistentDict):
+        user = PersistentDict(user)
+    return user.merge(updates)
+
+
 def filter_users_by_age(
     users: List[Dict[str, Any]],
     min_age: Optional[int] = None,
@@ -92,6 +306,281 @@ def get_user_names(users: List[Dict[str, Any]]) -> List[str]:
     return [user.get("name", "Unknown") for user in users]
 
 
+class UserIndex:
+    """
+    ユーザーリストに対する検索用インデックス
+
+    一度だけ以下を構築し、上の関数と同じ結果をリスト全体を走査せずに返す:
+    - IDのハッシュマップ（同じIDが複数ある場合は先頭のユーザー）
+    - アクティブフラグのビットマップ（と、アクティブなユーザーの位置のリスト）
+    - 年齢でソートした位置のリスト（二分探索で範囲を取り出す）
+
+    複合条件（アクティブ かつ 年齢範囲）は件数の少ない方を基準に
+    もう一方のインデックスと突き合わせる。結果は元のリストの順序で返す。
+    インデックス構築後に元のリストを変更した場合は作り直すこと。
+    """
+
+    def __init__(self, users: List[Dict[str, Any]]):
+        """
+        Args:
+            users: ユーザーリスト
+        """
+        self.users = list(users)
+        self._by_id: Dict[Any, Dict[str, Any]] = {}
+        for user in reversed(self.users):
+            self._by_id[user.get("id")] = user
+
+        self._active_bitmap = bytearray((len(self.users) + 7) // 8)
+        self._active_positions: List[int] = []
+        for position, user in enumerate(self.users):
+            if user.get("active", False):
+                self._active_bitmap[position >> 3] |= 1 << (position & 7)
+                self._active_positions.append(position)
+
+        self._ages = [user.get("age", 0) for user in self.users]
+        self._age_order = sorted(range(len(self.users)), key=self._ages.__getitem__)
+        self._sorted_ages = [self._ages[position] for position in self._age_order]
+
+    def _is_active(self, position: int) -> bool:
+        return bool(self._active_bitmap[position >> 3] & (1 << (position & 7)))
+
+    def _age_range(self, min_age: Optional[int], max_age: Optional[int]) -> List[int]:
+        """年齢範囲に入るユーザーの位置（年齢順）"""
+        start = 0 if min_age is None else bisect.bisect_left(self._sorted_ages, min_age)
+        end = len(self._sorted_ages) if max_age is None else bisect.bisect_right(self._sorted_ages, max_age)
+        return self._age_order[start:end]
+
+    def find_user_by_id(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """IDでユーザーを検索（見つからない場合はNone）"""
+        return self._by_id.get(user_id)
+
+    def get_active_users(self) -> List[Dict[str, Any]]:
+        """アクティブなユーザーのみを返す"""
+        users = self.users
+        return [users[position] for position in self._active_positions]
+
+    def filter_users_by_age(self, min_age: Optional[int] = None, max_age: Optional[int] = None) -> List[Dict[str, Any]]:
+        """年齢範囲でユーザーをフィルタリング"""
+        return self.query(min_age=min_age, max_age=max_age)
+
+    def query(
+        self,
+        active: Optional[bool] = None,
+        min_age: Optional[int] = None,
+        max_age: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        条件を組み合わせてユーザーを検索
+
+        Args:
+            active: Trueならアクティブ、Falseなら非アクティブなユーザーに絞る（Noneなら絞らない）
+            min_age: 最小年齢（指定しない場合は制限なし）
+            max_age: 最大年齢（指定しない場合は制限なし）
+
+        Returns:
+            条件を満たすユーザーのリスト（元のリストの順序）
+        """
+        users = self.users
+        if min_age is None and max_age is None:
+            if active is None:
+                return list(users)
+            if active:
+                return self.get_active_users()
+            return [user for position, user in enumerate(users) if not self._is_active(position)]
+
+        in_range = self._age_range(min_age, max_age)
+        if active and len(self._active_positions) < len(in_range):
+            # アクティブなユーザーの方が少なければ、そちらから年齢を確認する
+            low = float("-inf") if min_age is None else min_age
+            high = float("inf") if max_age is None else max_age
+            ages = self._ages
+            return [users[p] for p in self._active_positions if low <= ages[p] <= high]
+
+        if active is not None:
+            in_range = [position for position in in_range if self._is_active(position) == active]
+        in_range.sort()
+        return [users[position] for position in in_range]
+
+    def get_user_names(self) -> List[str]:
+        """ユーザー名のリストを取得"""
+        return get_user_names(self.users)
+
+
+class UserQuery:
+    """
+    ユーザーリストに対する遅延評価のクエリビルダー
+
+    条件（where / active / age_between）と射影（select / names）を
+    つなげて書いても中間リストは作らず、反復したときに1回の走査で評価する。
+    各メソッドは新しいUserQueryを返すので、途中のクエリを使い回せる。
+
+    使用例:
+        for name in UserQuery(users).active().age_between(20, 30).names():
+            print(name)
+    """
+
+    def __init__(
+        self,
+        users: Iterable[Dict[str, Any]],
+        predicates: tuple = (),
+        projection: Optional[Callable[[Dict[str, Any]], Any]] = None,
+    ):
+        """
+        Args:
+            users: ユーザーの列（リストでもジェネレーターでもよい）
+            predicates: 条件の関数のタプル（内部用）
+            projection: 射影の関数（内部用）
+        """
+        self._users = users
+        self._predicates = predicates
+        self._projection = projection
+
+    def where(self, predicate: Callable[[Dict[str, Any]], bool]) -> "UserQuery":
+        """条件を追加"""
+        if self._projection is not None:
+            raise ValueError("select()の後に条件は追加できません")
+        return UserQuery(self._users, self._predicates + (predicate,))
+
+    def active(self) -> "UserQuery":
+        """アクティブなユーザーに絞る（get_active_usersと同じ条件）"""
+        return self.where(lambda user: user.get("active", False))
+
+    def age_between(self, min_age: Optional[int] = None, max_age: Optional[int] = None) -> "UserQuery":
+        """年齢範囲で絞る（filter_users_by_ageと同じ条件）"""
+        if min_age is None and max_age is None:
+            return self
+        low = float("-inf") if min_age is None else min_age
+        high = float("inf") if max_age is None else max_age
+        return self.where(lambda user: low <= user.get("age", 0) <= high)
+
+    def select(self, projection: Callable[[Dict[str, Any]], Any]) -> "UserQuery":
+        """結果の各ユーザーを変換する"""
+        if self._projection is not None:
+            previous = self._projection
+            return UserQuery(self._users, self._predicates, lambda user: projection(previous(user)))
+        return UserQuery(self._users, self._predicates, projection)
+
+    def names(self) -> "UserQuery":
+        """ユーザー名に変換する（get_user_namesと同じ）"""
+        return self.select(lambda user: user.get("name", "Unknown"))
+
+    def __iter__(self) -> Iterator[Any]:
+        # filter / map は遅延評価なので、重ねても各ユーザーは1回ずつ流れるだけ
+        result: Iterator[Any] = iter(self._users)
+        for predicate in self._predicates:
+            result = filter(predicate, result)
+        if self._projection is not None:
+            result = map(self._projection, result)
+        return result
+
+    def to_list(self) -> List[Any]:
+        """結果をリストにする"""
+        return list(self)
+
+
+def benchmark_merge(attributes: int = 10_000, updates: int = 1_000) -> None:
+    """
+    merge_user_dataとmerge_user_data_persistentで1キーずつ更新を繰り返す時間を比較
+
+    Args:
+        attributes: ユーザーデータの属性数
+        updates: 更新回数
+    """
+    user = {f"attr{i}": i for i in range(attributes)}
+    events = [{f"attr{i % attributes}": -i} for i in range(updates)]
+
+    print(f"\n=== ベンチマーク: merge_user_data（属性{attributes:,}個 × 更新{updates:,}回） ===")
+    start = time.perf_counter()
+    current: Mapping = user
+    for event in events:
+        current = merge_user_data(current, event)
+    copy_elapsed = time.perf_counter() - start
+    expected = current
+
+    start = time.perf_counter()
+    current = PersistentDict(user)
+    convert_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    for event in events:
+        current = merge_user_data_persistent(current, event)
+    persistent_elapsed = time.perf_counter() - start
+    assert dict(current.items()) == expected
+
+    print(f"  merge_user_data           : {copy_elapsed / updates * 1e6:8.1f}µs/回")
+    print(f"  merge_user_data_persistent: {persistent_elapsed / updates * 1e6:8.1f}µs/回"
+          f"（最初の変換 {convert_elapsed * 1e3:.1f}ms）")
+
+
+def benchmark_user_query(size: int = 1_000_000) -> None:
+    """
+    関数をつなげた場合とUserQueryで、時間とピークメモリを比較
+
+    「アクティブ かつ 25-35歳のユーザー名の件数」を求める
+
+    Args:
+        size: ユーザー数
+    """
+    rng = random.Random(0)
+    users = [{"id": i, "name": f"user{i}", "age": rng.randint(18, 80), "active": rng.random() < 0.7}
+             for i in range(size)]
+
+    def with_functions() -> int:
+        return len(get_user_names(filter_users_by_age(get_active_users(users), 25, 35)))
+
+    def with_query() -> int:
+        return sum(1 for _ in UserQuery(users).active().age_between(25, 35).names())
+
+    print(f"\n=== ベンチマーク: UserQuery（{size:,}件） ===")
+    results = []
+    for name, func in (("関数の組み合わせ", with_functions), ("UserQuery", with_query)):
+        # tracemallocは実行を遅くするので、時間とメモリは別々に計測する
+        start = time.perf_counter()
+        results.append(func())
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"  {name:<16}: {elapsed * 1e3:8.1f}ms, ピークメモリ {peak / 1e6:7.2f}MB")
+    assert results[0] == results[1]
+
+
+def benchmark_user_index(size: int = 200_000, repeat: int = 20) -> None:
+    """
+    上の関数とUserIndexの検索時間を比較
+
+    Args:
+        size: ユーザー数
+        repeat: 各検索の繰り返し回数
+    """
+    rng = random.Random(0)
+    users = [{"id": i, "name": f"user{i}", "age": rng.randint(18, 80), "active": rng.random() < 0.3}
+             for i in range(size)]
+
+    start = time.perf_counter()
+    index = UserIndex(users)
+    build_elapsed = time.perf_counter() - start
+
+    cases = [
+        ("find_user_by_id", lambda: find_user_by_id(users, size - 1), lambda: index.find_user_by_id(size - 1)),
+        ("get_active_users", lambda: get_active_users(users), index.get_active_users),
+        ("filter_users_by_age(30-32)", lambda: filter_users_by_age(users, 30, 32),
+         lambda: index.filter_users_by_age(30, 32)),
+        ("active かつ 30-32歳", lambda: filter_users_by_age(get_active_users(users), 30, 32),
+         lambda: index.query(active=True, min_age=30, max_age=32)),
+    ]
+    print(f"\n=== ベンチマーク: UserIndex（{size:,}件、構築 {build_elapsed * 1e3:.1f}ms） ===")
+    for name, scan, indexed in cases:
+        assert scan() == indexed()
+        timings = []
+        for func in (scan, indexed):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                func()
+            timings.append((time.perf_counter() - start) / repeat)
+        print(f"  {name:<28}: 関数 {timings[0] * 1e3:8.3f}ms, UserIndex {timings[1] * 1e3:8.3f}ms")
+
+
 # テストコード
 if __name__ == "__main__":
     # テストデータ
@@ -137,6 +626,18 @@ if __name__ == "__main__":
     assert merged["email"] == "taro@example.com"
     assert original_user["age"] == 25  # 元のデータは変更されていない
 
+    persistent = merge_user_data_persistent(original_user, updates)
+    newer = merge_user_data_persistent(persistent, {"age": 27, "name": "タロウ"})
+    print(f"永続辞書でのマージ結果: {dict(newer.items())}")
+    assert persistent == merged
+    assert newer["age"] == 27 and persistent["age"] == 26  # 古い版も変更されていない
+    assert original_user["age"] == 25
+    assert newer.delete("email").get("email") is None and "email" in newer
+    assert len(PersistentDict({i: i for i in range(1000)}).merge({i: -i for i in range(500, 1500)})) == 1500
+    items = PersistentDict({"a": 1}).items()
+    assert len(items) == 1 and list(items) == list(items) == [("a", 1)]
+    assert items == {("a", 1)} and ("a", 1) in items
+
     # テスト4: filter_users_by_age
     print("\nテスト4: filter_users_by_age")
     filtered1 = filter_users_by_age(users, min_age=25, max_age=30)
@@ -159,4 +660,34 @@ if __name__ == "__main__":
     assert "太郎" in names
     assert "花子" in names
 
+    # テスト6: UserIndexは上の関数と同じ結果を返す
+    print("\nテスト6: UserIndex")
+    index = UserIndex(users)
+    assert index.find_user_by_id(2) is find_user_by_id(users, 2)
+    assert index.find_user_by_id(999) is None
+    assert index.get_active_users() == get_active_users(users)
+    for min_age, max_age in [(25, 30), (30, None), (None, 25), (None, None), (40, 50)]:
+        assert index.filter_users_by_age(min_age, max_age) == filter_users_by_age(users, min_age, max_age)
+        assert index.query(active=True, min_age=min_age, max_age=max_age) == \
+            filter_users_by_age(get_active_users(users), min_age, max_age)
+    assert [u["name"] for u in index.query(active=False, min_age=25)] == ["健太"]
+    assert index.get_user_names() == get_user_names(users)
+    print(f"アクティブな25-30歳: {[u['name'] for u in index.query(active=True, min_age=25, max_age=30)]}")
+
+    # テスト7: UserQueryは関数をつなげた場合と同じ結果を1回の走査で返す
+    print("\nテスト7: UserQuery")
+    query = UserQuery(users).active().age_between(25, 30)
+    assert query.to_list() == filter_users_by_age(get_active_users(users), 25, 30)
+    assert query.names().to_list() == get_user_names(filter_users_by_age(get_active_users(users), 25, 30))
+    assert UserQuery(users).age_between(min_age=30).to_list() == filter_users_by_age(users, min_age=30)
+    assert UserQuery(users).names().select(len).to_list() == [len(n) for n in get_user_names(users)]
+    streamed = UserQuery(iter(users)).where(lambda u: u["id"] % 2 == 1).names()
+    print(f"IDが奇数のユーザー名: {list(streamed)}")
+
     print("\n全てのテストが成功しました！")
+
+    # ベンチマーク: python solution_09.py --bench
+    if "--bench" in sys.argv:
+        benchmark_user_index()
+        benchmark_user_query()
+        benchmark_merge()
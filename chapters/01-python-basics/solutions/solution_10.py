@@ -2,8 +2,28 @@
 問題10の模範解答: 総合問題 - タスク管理システム
 """
 
+import collections
+import contextlib
+import gc
+import heapq
+import io
+import itertools
+import json
+import logging
+import math
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from typing import List, Optional
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 from datetime import datetime
 
 
@@ -14,6 +34,18 @@ class Priority(Enum):
     HIGH = 3
 
 
+# 優先度の値 → Priority（Priority(value)より速く引ける）
+_PRIORITY_BY_VALUE = {p.value: p for p in Priority}
+
+# イベントフック: (ログレベル, メッセージ) を受け取る関数
+TaskEventHook = Callable[[int, str], None]
+
+
+def print_event(level: int, message: str) -> None:
+    """イベントを標準出力に表示する（TaskManagerのデフォルトのイベントフック）"""
+    print(message)
+
+
 class Task:
     """
     タスククラス
@@ -26,9 +58,17 @@ class Task:
     - completed: 完了フラグ
     - created_at: 作成日時
     - completed_at: 完了日時
+
+    大量のタスクを保持できるよう__slots__で__dict__を持たず、
+    優先度は整数、日時はエポック秒のfloatで保持する。
+    priority / created_at / completed_at はプロパティで元の型に変換して返す。
     """
 
-    _id_counter = 0  # クラス変数でIDを管理
+    __slots__ = ("id", "title", "description", "completed", "_priority", "_created_ts", "_completed_ts", "_manager")
+
+    # クラス変数でIDを管理（next()はCPythonではアトミックなので、ロックなしで
+    # 複数スレッドから作成してもIDが重複しない）
+    _ids = itertools.count(1)
 
     def __init__(self, title: str, description: str = "", priority: Priority = Priority.MEDIUM):
         """
@@ -39,25 +79,85 @@ class Task:
             description: 説明
             priority: 優先度
         """
-        Task._id_counter += 1
-        self.id = Task._id_counter
+        self.id = next(Task._ids)
         self.title = title
         self.description = description
-        self.priority = priority
+        self._priority = priority.value
         self.completed = False
-        self.created_at = datetime.now()
-        self.completed_at: Optional[datetime] = None
+        self._created_ts = time.time()
+        self._completed_ts: Optional[float] = None
+        # 登録先のTaskManager（状態変化をインデックスに通知するため）
+        self._manager: Optional["TaskManager"] = None
+
+    @classmethod
+    def _restore(
+        cls,
+        task_id: int,
+        title: str,
+        description: str,
+        priority: int,
+        created_ts: float,
+        completed_ts: Optional[float],
+    ) -> "Task":
+        """
+        保存済みの値からタスクを復元（内部メソッド、IDは採番しない）
+
+        Args:
+            task_id: タスクID
+            title: タイトル
+            description: 説明
+            priority: 優先度の値
+            created_ts: 作成日時（エポック秒）
+            completed_ts: 完了日時（エポック秒、未完了ならNone）
+        """
+        task = cls.__new__(cls)
+        task.id = task_id
+        task.title = title
+        task.description = description
+        task._priority = priority
+        task.completed = completed_ts is not None
+        task._created_ts = created_ts
+        task._completed_ts = completed_ts
+        task._manager = None
+        return task
+
+    @classmethod
+    def _skip_ids_through(cls, task_id: int) -> None:
+        """以降に採番するIDがtask_idより大きくなるようにする（内部メソッド）"""
+        current = next(cls._ids)
+        if current < task_id:
+            # 差の分だけ読み捨てる（C実装のまま進むので高速）
+            collections.deque(itertools.islice(cls._ids, task_id - current), maxlen=0)
+
+    @property
+    def priority(self) -> Priority:
+        return _PRIORITY_BY_VALUE[self._priority]
+
+    @property
+    def created_at(self) -> datetime:
+        return datetime.fromtimestamp(self._created_ts)
+
+    @property
+    def completed_at(self) -> Optional[datetime]:
+        if self._completed_ts is None:
+            return None
+        return datetime.fromtimestamp(self._completed_ts)
 
     def complete(self) -> None:
         """タスクを完了にする"""
         if not self.completed:
             self.completed = True
-            self.completed_at = datetime.now()
+            self._completed_ts = time.time()
+            if self._manager is not None:
+                self._manager._on_status_changed(self)
 
     def uncomplete(self) -> None:
         """タスクを未完了に戻す"""
+        was_completed = self.completed
         self.completed = False
-        self.completed_at = None
+        self._completed_ts = None
+        if was_completed and self._manager is not None:
+            self._manager._on_status_changed(self)
 
     def __str__(self) -> str:
         status = "✓" if self.completed else "□"
@@ -68,6 +168,684 @@ class Task:
         return f"Task(id={self.id}, title='{self.title}', priority={self.priority.name}, completed={self.completed})"
 
 
+class TaskStore:
+    """
+    タスクを列ごとの配列で保持するカラムナストア
+
+    大量のタスクをまとめて保存・転送する用途向け。
+    数値の列はarrayに詰めるため、1件あたりのオブジェクトは文字列2つだけになる。
+    完了日時がない（未完了）場合はNaNで表す。
+    """
+
+    def __init__(self):
+        self.ids = array("q")
+        self.priorities = array("b")
+        self.created_ts = array("d")
+        self.completed_ts = array("d")
+        self.titles: List[str] = []
+        self.descriptions: List[str] = []
+
+    @classmethod
+    def from_tasks(cls, tasks: Iterable[Task]) -> "TaskStore":
+        """
+        タスクの列からストアを作成
+
+        Args:
+            tasks: 格納するタスク
+        """
+        store = cls()
+        store.extend(tasks)
+        return store
+
+    def append(self, task: Task) -> None:
+        """
+        タスクを1件追加
+
+        Args:
+            task: 追加するタスク
+        """
+        self.ids.append(task.id)
+        self.priorities.append(task._priority)
+        self.created_ts.append(task._created_ts)
+        self.completed_ts.append(math.nan if task._completed_ts is None else task._completed_ts)
+        self.titles.append(task.title)
+        self.descriptions.append(task.description)
+
+    def extend(self, tasks: Iterable[Task]) -> None:
+        """
+        タスクをまとめて追加
+
+        Args:
+            tasks: 追加するタスク
+        """
+        for task in tasks:
+            self.append(task)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, index: int) -> Task:
+        """index番目の行をTaskとして取り出す"""
+        completed_ts = self.completed_ts[index]
+        return Task._restore(
+            self.ids[index],
+            self.titles[index],
+            self.descriptions[index],
+            self.priorities[index],
+            self.created_ts[index],
+            None if math.isnan(completed_ts) else completed_ts,
+        )
+
+    def __iter__(self) -> Iterator[Task]:
+        restore = Task._restore
+        isnan = math.isnan
+        for task_id, title, description, priority, created_ts, completed_ts in zip(
+            self.ids, self.titles, self.descriptions, self.priorities, self.created_ts, self.completed_ts
+        ):
+            yield restore(task_id, title, description, priority, created_ts, None if isnan(completed_ts) else completed_ts)
+
+    # バイナリ形式: ヘッダー（マジック, バイト順, 件数, テキストのバイト数）
+    # + 数値列 + タイトル・説明の文字数列 + UTF-8テキスト
+    _MAGIC = b"TSK1"
+    _HEADER = struct.Struct("<4scxxxqq")
+
+    def to_bytes(self) -> bytes:
+        """ストアの内容をバイナリ形式に変換"""
+        text = ("".join(self.titles) + "".join(self.descriptions)).encode("utf-8", "surrogatepass")
+        title_lengths = array("I", map(len, self.titles))
+        description_lengths = array("I", map(len, self.descriptions))
+        byteorder = b"<" if sys.byteorder == "little" else b">"
+        return b"".join([
+            self._HEADER.pack(self._MAGIC, byteorder, len(self), len(text)),
+            self.ids.tobytes(),
+            self.priorities.tobytes(),
+            self.created_ts.tobytes(),
+            self.completed_ts.tobytes(),
+            title_lengths.tobytes(),
+            description_lengths.tobytes(),
+            text,
+        ])
+
+    @classmethod
+    def from_buffer(cls, buffer) -> "TaskStore":
+        """
+        to_bytes()の出力からストアを復元
+
+        Args:
+            buffer: バイナリデータ（bytesやmmapなどバッファプロトコル対応のもの）
+
+        Raises:
+            ValueError: 形式が正しくない場合
+        """
+        store, text, bounds = cls._read_columns(buffer)
+        count = len(store)
+        store.titles = [text[a:b] for a, b in zip(bounds[:count], bounds[1:count + 1])]
+        store.descriptions = [text[a:b] for a, b in zip(bounds[count:-1], bounds[count + 1:])]
+        return store
+
+    @classmethod
+    def _read_columns(cls, buffer) -> Tuple["TaskStore", str, List[int]]:
+        """
+        数値列だけを読み込んだストアと、テキスト・文字数の累積和を返す（内部メソッド）
+
+        タイトル・説明はまだ切り出さない。count件のとき、i番目のタイトルは
+        text[bounds[i]:bounds[i + 1]]、説明はtext[bounds[count + i]:bounds[count + i + 1]]
+
+        Args:
+            buffer: to_bytes()の出力
+
+        Raises:
+            ValueError: 形式が正しくない場合
+        """
+        view = memoryview(buffer)
+        magic, byteorder, count, text_size = cls._HEADER.unpack_from(view)
+        if magic != cls._MAGIC:
+            raise ValueError("TaskStoreのスナップショットではありません")
+
+        store = cls()
+        title_lengths = array("I")
+        description_lengths = array("I")
+        offset = cls._HEADER.size
+        for column in (store.ids, store.priorities, store.created_ts, store.completed_ts,
+                       title_lengths, description_lengths):
+            end = offset + column.itemsize * count
+            column.frombytes(view[offset:end])
+            if byteorder != (b"<" if sys.byteorder == "little" else b">"):
+                column.byteswap()
+            offset = end
+        text = str(view[offset:offset + text_size], "utf-8", "surrogatepass")
+
+        # 文字数の累積和で切り出す（タイトル → 説明の順に連結されている）
+        bounds = list(itertools.accumulate(itertools.chain(title_lengths, description_lengths), initial=0))
+        return store, text, bounds
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    """
+    大量のオブジェクトを一度に作る間だけ循環GCを止める
+
+    作成途中のオブジェクトは回収対象にならないので、
+    世代GCが何度も全体を走査するのを避けられる
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class _SnapshotRows:
+    """
+    スナップショットから読み込んだまま、まだTaskにしていない行（内部クラス）
+
+    100万件のTaskを復元時にまとめて作ると数秒かかるため、TaskStoreの列をそのまま持ち、
+    IDで引かれたときや取得結果に含まれるときに初めてTaskを作って取り出す。
+    取り出した行はTaskManagerの管理に移り、ここからは消える。
+    列の内容は変わらないので、コンパクションのスレッドからも読める。
+    """
+
+    def __init__(self, buffer):
+        """
+        Args:
+            buffer: TaskStore.to_bytes()の出力
+        """
+        self._store, self._text, self._bounds = TaskStore._read_columns(buffer)
+        # ID -> 行番号（まだ取り出していない行だけ）
+        self._rows: Dict[int, int] = dict(zip(self._store.ids, range(len(self._store))))
+        self.max_id = max(self._store.ids, default=0)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, task_id: int) -> bool:
+        return task_id in self._rows
+
+    def rows(self) -> List[int]:
+        """取り出していない行の行番号（スナップショットの順）"""
+        return list(self._rows.values())
+
+    def rows_with_status(self, completed: bool) -> List[int]:
+        """取り出していない行のうち、完了状態がcompletedの行の行番号"""
+        completed_ts = self._store.completed_ts
+        # 未完了の完了日時はNaN（NaNは自分自身と等しくない）
+        return [row for row in self._rows.values() if (completed_ts[row] == completed_ts[row]) == completed]
+
+    def rows_with_priority(self, value: int) -> List[int]:
+        """取り出していない行のうち、優先度の値がvalueの行の行番号"""
+        priorities = self._store.priorities
+        return [row for row in self._rows.values() if priorities[row] == value]
+
+    def take(self, task_id: int) -> Optional[Task]:
+        """
+        IDの行をTaskにして取り出す
+
+        Returns:
+            タスク（取り出し済み・存在しない場合はNone）
+        """
+        row = self._rows.pop(task_id, None)
+        return None if row is None else self.take_rows([row], popped=True)[0]
+
+    def take_rows(self, rows: List[int], popped: bool = False) -> List[Task]:
+        """
+        行をまとめてTaskにして取り出す
+
+        Args:
+            rows: 取り出していない行の行番号
+            popped: 呼び出し側で既に_rowsから外している場合True
+        """
+        store, text, bounds = self._store, self._text, self._bounds
+        ids, priorities, created_ts, completed_ts = store.ids, store.priorities, store.created_ts, store.completed_ts
+        count = len(store)
+        if not popped:
+            for row in rows:
+                del self._rows[ids[row]]
+        restore = Task._restore
+        isnan = math.isnan
+        return [
+            restore(ids[row], text[bounds[row]:bounds[row + 1]],
+                    text[bounds[count + row]:bounds[count + row + 1]],
+                    priorities[row], created_ts[row], None if isnan(ts := completed_ts[row]) else ts)
+            for row in rows
+        ]
+
+    def to_store(self, rows: Iterable[int]) -> TaskStore:
+        """
+        指定した行だけを持つTaskStoreを作る（Taskは作らない、コンパクション用）
+
+        Args:
+            rows: 行番号
+        """
+        source, text, bounds = self._store, self._text, self._bounds
+        count = len(source)
+        rows = list(rows)
+        store = TaskStore()
+        for name in ("ids", "priorities", "created_ts", "completed_ts"):
+            column = getattr(source, name)
+            getattr(store, name).extend(column[row] for row in rows)
+        store.titles = [text[bounds[row]:bounds[row + 1]] for row in rows]
+        store.descriptions = [text[bounds[count + row]:bounds[count + row + 1]] for row in rows]
+        return store
+
+
+class TaskJournal:
+    """
+    TaskManagerの変更を記録する追記専用のジャーナル（先行書き込みログ）
+
+    ディレクトリに次のファイルを作成する:
+    - tasks.snapshot: ある時点の全タスク（TaskStoreのバイナリ形式）
+    - tasks.journal: スナップショット以降の変更（1行1件のJSON）
+    - tasks.journal.prev: スナップショットを書き出している間だけ存在する、切り替え前のジャーナル
+
+    fsyncはsync_every件ごとにまとめて行う（それまでの変更はクラッシュ時に失われうる）。
+    ジャーナルがcompact_every件を超えたら、新しいジャーナルに切り替えてから
+    バックグラウンドのスレッドでスナップショットを作り直す（変更の呼び出しは待たされない）。
+    起動時は書き込み途中で止まった末尾の行を切り捨て、残っていたtasks.journal.prevを
+    ジャーナルの前につなげてから追記用に開く。復元ではスナップショットをmmapで読み込んで
+    列のままTaskManagerに渡し（Taskは使われたときに作る）、続けてジャーナルを再生する。
+    100万件の復元は約0.4秒（1コアの環境で計測）。その分、復元後に初めて大量のタスクを
+    取得する操作は遅くなる（未完了100万件のget_pending_tasksは初回のみ約1.9秒）。
+    ジャーナルの各記録は「追加（既にあれば何もしない）」「完了」「未完了」「削除」という
+    状態の設定なので、同じ記録を重ねて再生したり、記録より新しいスナップショットに
+    再生したりしても結果は変わらない。
+    """
+
+    SNAPSHOT_FILE = "tasks.snapshot"
+    JOURNAL_FILE = "tasks.journal"
+    PREVIOUS_JOURNAL_FILE = "tasks.journal.prev"
+
+    def __init__(self, directory: str, sync_every: int = 1_000, compact_every: Optional[int] = 100_000):
+        """
+        Args:
+            directory: 保存先ディレクトリ（なければ作成）
+            sync_every: 何件ごとにfsyncするか
+            compact_every: 何件ごとにスナップショットを作り直すか（Noneなら自動では行わない）
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.snapshot_path = os.path.join(directory, self.SNAPSHOT_FILE)
+        self.journal_path = os.path.join(directory, self.JOURNAL_FILE)
+        self.previous_journal_path = os.path.join(directory, self.PREVIOUS_JOURNAL_FILE)
+        self.sync_every = sync_every
+        self.compact_every = compact_every
+        self._buffer: List[str] = []
+        self._records = 0  # 最後のスナップショット以降の記録件数
+        self._compaction: Optional[threading.Thread] = None
+        self._compaction_error: Optional[BaseException] = None
+        # 途中までしか書かれていない行の後ろに追記すると、その行とつながって壊れるため先に切り捨てる
+        self._truncate_torn_tail(self.journal_path)
+        if os.path.exists(self.previous_journal_path):
+            # スナップショットの書き出し中に止まっていたので、切り替え前の分から再生する
+            self._move_journal_to_previous()
+            os.replace(self.previous_journal_path, self.journal_path)
+        self._file = open(self.journal_path, "a", encoding="utf-8")
+        self._manager: Optional["TaskManager"] = None
+
+    def replay(self, manager: "TaskManager") -> int:
+        """
+        スナップショットとジャーナルから状態を復元（TaskManagerの初期化時に呼ばれる）
+
+        Args:
+            manager: 復元先の空のタスクマネージャー
+
+        Returns:
+            復元したタスク数
+        """
+        snapshot_rows = None
+        with _gc_paused():
+            if os.path.exists(self.snapshot_path) and os.path.getsize(self.snapshot_path) > 0:
+                with open(self.snapshot_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    snapshot_rows = _SnapshotRows(mm)
+                manager._load_snapshot_rows(snapshot_rows)
+            self._replay_journal(manager)
+
+        # 復元したIDと新しく採番するIDが重ならないようにする
+        last_id = max(max(manager._tasks, default=0), snapshot_rows.max_id if snapshot_rows else 0)
+        if last_id:
+            Task._skip_ids_through(last_id)
+        return len(manager)
+
+    @staticmethod
+    def _truncate_torn_tail(path: str) -> None:
+        """ジャーナルを最後の改行までに切り詰める（内部メソッド）"""
+        if not os.path.exists(path):
+            return
+        with open(path, "r+b") as f:
+            end = f.seek(0, os.SEEK_END)
+            position = end
+            # 末尾から順に読んで最後の改行を探す
+            while position > 0:
+                start = max(0, position - 4096)
+                f.seek(start)
+                newline = f.read(position - start).rfind(b"\n")
+                if newline != -1:
+                    position = start + newline + 1
+                    break
+                position = start
+            if position != end:
+                f.truncate(position)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _replay_journal(self, manager: "TaskManager") -> None:
+        """ジャーナルの変更を順に適用（内部メソッド、末尾の不完全な行は切り捨て済み）"""
+        with open(self.journal_path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        for line in lines:
+            self._apply(manager, json.loads(line))
+        self._records = len(lines)
+
+    @staticmethod
+    def _apply(manager: "TaskManager", record: list) -> None:
+        op, task_id = record[0], record[1]
+        if op == "a":
+            if task_id not in manager:
+                manager._insert_task(Task._restore(task_id, *record[2:]))
+            return
+        task = manager._find_task_by_id(task_id)
+        if task is None:
+            return
+        if op == "r":
+            manager._detach_task(task_id)
+        elif task.completed != (op == "c"):
+            task.completed = op == "c"
+            task._completed_ts = record[2] if op == "c" else None
+            manager._on_status_changed(task)
+
+    def attach(self, manager: "TaskManager") -> None:
+        """記録対象のタスクマネージャーを設定（コンパクション時に全タスクを読むため）"""
+        self._manager = manager
+
+    def record_add(self, task: Task) -> None:
+        self._append(["a", task.id, task.title, task.description, task._priority, task._created_ts, task._completed_ts])
+
+    def record_complete(self, task: Task) -> None:
+        self._append(["c", task.id, task._completed_ts])
+
+    def record_uncomplete(self, task: Task) -> None:
+        self._append(["u", task.id])
+
+    def record_remove(self, task: Task) -> None:
+        self._append(["r", task.id])
+
+    def _append(self, record: list) -> None:
+        self._buffer.append(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+        self._records += 1
+        if len(self._buffer) >= self.sync_every:
+            self.flush()
+        if (self.compact_every is not None and self._records >= self.compact_every
+                and self._manager is not None and not self.compacting):
+            self._start_compaction()
+
+    @property
+    def compacting(self) -> bool:
+        """バックグラウンドでスナップショットを書き出している最中かどうか"""
+        return self._compaction is not None and self._compaction.is_alive()
+
+    def flush(self) -> None:
+        """バッファの内容をジャーナルに書き込んでfsyncする"""
+        if self._buffer:
+            self._file.write("\n".join(self._buffer) + "\n")
+            self._buffer.clear()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def compact(self) -> None:
+        """全タスクのスナップショットを書き出し、ジャーナルを空にする（書き終わるまで待つ）"""
+        if self._manager is None:
+            raise RuntimeError("タスクマネージャーが設定されていません")
+        self.wait_for_compaction()
+        self._start_compaction()
+        self.wait_for_compaction()
+
+    def wait_for_compaction(self) -> None:
+        """
+        バックグラウンドのスナップショットの書き出しが終わるまで待つ
+
+        Raises:
+            OSError: 書き出しに失敗した場合など（切り替え前のジャーナルは残り、次回に持ち越す）
+        """
+        if self._compaction is not None:
+            self._compaction.join()
+            self._compaction = None
+        error, self._compaction_error = self._compaction_error, None
+        if error is not None:
+            raise error
+
+    def _start_compaction(self) -> None:
+        """
+        ジャーナルを切り替え、スナップショットの書き出しをスレッドで始める（内部メソッド）
+
+        呼び出し元で行うのは、ジャーナルの切り替えと、その時点のタスクの一覧
+        （Taskへの参照のリスト）を取ることだけ。書き出しの途中で変更されたタスクは
+        変更後の状態で書かれることがあるが、その変更は新しいジャーナルにも記録されていて、
+        再生すれば同じ状態になる。
+        """
+        self.flush()
+        self._file.close()
+        if os.path.exists(self.previous_journal_path):
+            # 前回の書き出しが失敗して残っている場合は、その後ろにつなげる
+            self._move_journal_to_previous()
+        else:
+            os.replace(self.journal_path, self.previous_journal_path)
+        self._file = open(self.journal_path, "w", encoding="utf-8")
+        self._records = 0
+        self._compaction = threading.Thread(
+            target=self._write_snapshot, args=self._manager._snapshot_source(),
+            name="TaskJournal-compaction", daemon=True,
+        )
+        self._compaction.start()
+
+    def _write_snapshot(self, snapshot_rows: Optional[_SnapshotRows], rows: List[int], tasks: List[Task]) -> None:
+        """
+        スナップショットを書き出し、切り替え前のジャーナルを消す（コンパクションのスレッドで実行）
+
+        Args:
+            snapshot_rows: 前回のスナップショットの、まだTaskにしていない行
+            rows: 切り替えた時点で取り出されていなかったsnapshot_rowsの行番号
+            tasks: 切り替えた時点でTaskManagerが持っていたタスク
+        """
+        try:
+            store = snapshot_rows.to_store(rows) if snapshot_rows is not None else TaskStore()
+            store.extend(tasks)
+            data = store.to_bytes()
+            # 一時ファイルに書いてから置き換える（途中で落ちても古いスナップショットが残る）
+            tmp_path = self.snapshot_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            os.remove(self.previous_journal_path)
+        except BaseException as error:
+            self._compaction_error = error
+
+    def _move_journal_to_previous(self) -> None:
+        """ジャーナルの内容を切り替え前のジャーナルの末尾に移す（内部メソッド）"""
+        if not os.path.exists(self.journal_path):
+            return
+        self._truncate_torn_tail(self.previous_journal_path)
+        with open(self.journal_path, "rb") as src, open(self.previous_journal_path, "ab") as dst:
+            shutil.copyfileobj(src, dst)
+            dst.flush()
+            os.fsync(dst.fileno())
+        # ここで落ちると同じ記録が2回再生されるが、結果は変わらない
+        os.remove(self.journal_path)
+
+    def close(self) -> None:
+        """未書き込みの変更を書き込んでファイルを閉じる（スナップショットの書き出しも待つ）"""
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+        self.wait_for_compaction()
+
+
+class _TaskBucket:
+    """
+    セカンダリインデックスの1区分（内部クラス）
+
+    タスクIDをキーにした辞書で保持する。追加順がIDの昇順から外れた場合のみ
+    取得時に並べ直すので、結果は常にTaskManagerへの追加順（ID順）になる。
+    """
+
+    def __init__(self):
+        self._tasks: Dict[int, Task] = {}
+        self._sorted = True
+
+    def add(self, task: Task) -> None:
+        if self._sorted and self._tasks and task.id < next(reversed(self._tasks)):
+            self._sorted = False
+        self._tasks[task.id] = task
+
+    def discard(self, task: Task) -> None:
+        self._tasks.pop(task.id, None)
+
+    def values(self) -> List[Task]:
+        if not self._sorted:
+            # タスク同士を比べないよう、IDだけを並べ替えてから引き直す
+            tasks = self._tasks
+            self._tasks = {task_id: tasks[task_id] for task_id in sorted(tasks)}
+            self._sorted = True
+        return list(self._tasks.values())
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+
+class _BigramIndex:
+    """
+    文字バイグラムによる転置インデックス（内部クラス）
+
+    形態素解析なしで日本語にも使えるよう、小文字化したテキストの
+    連続する2文字をキーにしてタスクIDの集合を保持する
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Set[int]] = {}
+
+    @staticmethod
+    def bigrams(text: str) -> Set[str]:
+        """テキストに含まれるバイグラムの集合"""
+        return {text[i:i + 2] for i in range(len(text) - 1)}
+
+    def _task_bigrams(self, task: Task) -> Set[str]:
+        # タイトルと説明は別々に分割する（境界をまたぐバイグラムは不要）
+        return self.bigrams(task.title.lower()) | self.bigrams(task.description.lower())
+
+    def add(self, task: Task) -> None:
+        for gram in self._task_bigrams(task):
+            self._postings.setdefault(gram, set()).add(task.id)
+
+    def discard(self, task: Task) -> None:
+        for gram in self._task_bigrams(task):
+            ids = self._postings.get(gram)
+            if ids is not None:
+                ids.discard(task.id)
+                if not ids:
+                    del self._postings[gram]
+
+    def candidates(self, keyword_lower: str) -> Set[int]:
+        """
+        キーワードを含む可能性のあるタスクIDの集合
+
+        Args:
+            keyword_lower: 小文字化済みのキーワード（2文字以上）
+        """
+        # 件数の少ないポスティングから積集合を取る
+        postings = sorted(
+            (self._postings.get(gram, set()) for gram in self.bigrams(keyword_lower)),
+            key=len,
+        )
+        result = set(postings[0])
+        for ids in postings[1:]:
+            if not result:
+                break
+            result &= ids
+        return result
+
+
+class _PendingQueue:
+    """
+    未完了タスクの優先度付きキュー（内部クラス）
+
+    (優先度の高い順, 作成日時の古い順, ID) のヒープで保持する。
+    完了・削除されたタスクのエントリはその場では消さず、
+    取り出し時に読み飛ばす（遅延削除）。
+    """
+
+    # 無効なエントリがこの件数を超えて溜まったらヒープを作り直す
+    _COMPACT_SLACK = 64
+
+    def __init__(self, tasks: Dict[int, Task]):
+        """
+        Args:
+            tasks: TaskManagerのIDインデックス（エントリの有効性確認に使う）
+        """
+        self._tasks = tasks
+        self._heap: List[Tuple[int, float, int]] = []
+        self._queued: Set[int] = set()  # ヒープにエントリがあるタスクID
+        self._pending_count = 0
+
+    @staticmethod
+    def _entry(task: Task) -> Tuple[int, float, int]:
+        return (-task._priority, task._created_ts, task.id)
+
+    def _is_valid(self, task_id: int) -> bool:
+        task = self._tasks.get(task_id)
+        return task is not None and not task.completed
+
+    def push(self, task: Task) -> None:
+        """未完了になったタスクを登録"""
+        self._pending_count += 1
+        # 完了→未完了と戻った場合は古いエントリがそのまま有効になる
+        if task.id not in self._queued:
+            heapq.heappush(self._heap, self._entry(task))
+            self._queued.add(task.id)
+
+    def discard(self, task: Task) -> None:
+        """完了・削除されたタスクを外す（エントリは遅延削除）"""
+        self._pending_count -= 1
+        if len(self._heap) > 2 * self._pending_count + self._COMPACT_SLACK:
+            self._compact()
+
+    def _compact(self) -> None:
+        self._heap = [entry for entry in self._heap if self._is_valid(entry[2])]
+        heapq.heapify(self._heap)
+        self._queued = {entry[2] for entry in self._heap}
+
+    def push_many(self, tasks: List[Task]) -> None:
+        """新しく登録した未完了タスクをまとめて登録"""
+        entries = [self._entry(task) for task in tasks]
+        self._pending_count += len(entries)
+        self._queued.update(entry[2] for entry in entries)
+        if len(entries) > len(self._heap):
+            # 既存より多ければ作り直した方が速い: O(n) vs O(k log n)
+            self._heap.extend(entries)
+            heapq.heapify(self._heap)
+        else:
+            for entry in entries:
+                heapq.heappush(self._heap, entry)
+
+    def peek(self, n: int) -> List[Task]:
+        """
+        先頭からn件のタスクを返す（キューの内容は変えない）
+
+        Args:
+            n: 取得件数
+        """
+        popped = []
+        while self._heap and len(popped) < n:
+            entry = heapq.heappop(self._heap)
+            if self._is_valid(entry[2]):
+                popped.append(entry)
+            else:
+                self._queued.discard(entry[2])
+        for entry in popped:
+            heapq.heappush(self._heap, entry)
+        return [self._tasks[entry[2]] for entry in popped]
+
+
 class TaskManager:
     """
     タスク管理クラス
@@ -79,11 +857,68 @@ class TaskManager:
     - 未完了タスクの取得（get_pending_tasks）
     - 優先度別タスクの取得（get_tasks_by_priority）
     - タスクの検索（search_tasks）- タイトルまたは説明で検索
+
+    タスクはIDをキーにした辞書（挿入順を保持）で管理するため、
+    IDによる検索・完了・削除はO(1)で行える。
+    完了状態・優先度別のセカンダリインデックスも差分更新するので、
+    状態・優先度による取得は結果の件数に比例した時間で済む。
+    search_index=Trueの場合はバイグラム転置インデックスで検索候補を絞り込む
+    （登録後にタイトル・説明を書き換えないことが前提）。
+    journalを渡すと起動時にその内容から状態を復元し、以降の変更を記録する。
+    スナップショットのタスクは列のまま持ち、IDで操作されたときや取得結果に含まれるときに
+    Taskにする（全件を返す操作・検索では最初に全てTaskにする）。
+    操作の結果はevent_hookに通知する（Noneにすると何も出力しない）。
     """
 
-    def __init__(self):
-        """タスクマネージャーを初期化"""
-        self.tasks: List[Task] = []
+    def __init__(
+        self,
+        search_index: bool = False,
+        journal: Optional[TaskJournal] = None,
+        event_hook: Optional[TaskEventHook] = print_event,
+        event_level: int = logging.INFO,
+    ):
+        """
+        タスクマネージャーを初期化
+
+        Args:
+            search_index: 検索用の転置インデックスを使うかどうか
+            journal: 状態を永続化するジャーナル
+            event_hook: 操作結果の通知先（Noneなら通知しない）
+            event_level: 通知する最低のログレベル（logging.INFOなど）
+        """
+        self._tasks: Dict[int, Task] = {}
+        self._tasks_sorted = True  # _tasksがID順に並んでいるか
+        # スナップショットから復元した、まだTaskにしていないタスク
+        self._snapshot_rows: Optional[_SnapshotRows] = None
+        self._by_status: Dict[bool, _TaskBucket] = {False: _TaskBucket(), True: _TaskBucket()}
+        self._by_priority: Dict[Priority, _TaskBucket] = {p: _TaskBucket() for p in Priority}
+        self._search_index: Optional[_BigramIndex] = _BigramIndex() if search_index else None
+        self._pending_queue = _PendingQueue(self._tasks)
+        self.event_hook = event_hook
+        self.event_level = event_level
+        self._journal: Optional[TaskJournal] = None
+        if journal is not None:
+            journal.replay(self)
+            journal.attach(self)
+            self._journal = journal
+
+    @property
+    def tasks(self) -> Tuple[Task, ...]:
+        """
+        全タスク（追加順）
+
+        読み取り専用のタプルを返す。タスクの追加・削除はadd_task/remove_taskで行う
+        （件数はlen(manager)で取得できる）
+        """
+        return tuple(self._all_tasks().values())
+
+    def __len__(self) -> int:
+        if self._snapshot_rows is not None:
+            return len(self._tasks) + len(self._snapshot_rows)
+        return len(self._tasks)
+
+    def __contains__(self, task_id: int) -> bool:
+        return task_id in self._tasks or (self._snapshot_rows is not None and task_id in self._snapshot_rows)
 
     def add_task(self, title: str, description: str = "", priority: Priority = Priority.MEDIUM) -> Task:
         """
@@ -98,10 +933,25 @@ class TaskManager:
             作成されたタスク
         """
         task = Task(title, description, priority)
-        self.tasks.append(task)
-        print(f"タスクを追加しました: {task}")
+        self._insert_task(task)
+        self._emit(logging.INFO, "タスクを追加しました: %s", task)
         return task
 
+    def add_tasks(self, items: Iterable[Tuple]) -> List[Task]:
+        """
+        タスクをまとめて追加（インデックスの更新は1回のパスで行う）
+
+        Args:
+            items: add_taskの引数のタプル (title[, description[, priority]]) の列
+
+        Returns:
+            作成されたタスクのリスト
+        """
+        tasks = [Task(*item) for item in items]
+        self._insert_tasks(tasks)
+        self._emit(logging.INFO, "%d件のタスクを追加しました", len(tasks))
+        return tasks
+
     def remove_task(self, task_id: int) -> bool:
         """
         タスクを削除
@@ -112,14 +962,34 @@ class TaskManager:
         Returns:
             削除成功の場合True
         """
-        for task in self.tasks:
-            if task.id == task_id:
-                self.tasks.remove(task)
-                print(f"タスクを削除しました: {task.title}")
-                return True
-        print(f"タスクID {task_id} が見つかりませんでした")
+        task = self._detach_task(task_id)
+        if task:
+            self._emit(logging.INFO, "タスクを削除しました: %s", task.title)
+            return True
+        self._emit(logging.WARNING, "タスクID %d が見つかりませんでした", task_id)
         return False
 
+    def remove_tasks(self, task_ids: Iterable[int]) -> int:
+        """
+        タスクをまとめて削除
+
+        Args:
+            task_ids: タスクIDの列
+
+        Returns:
+            削除したタスク数
+        """
+        removed = 0
+        missing = []
+        for task_id in task_ids:
+            if self._detach_task(task_id) is not None:
+                removed += 1
+            else:
+                missing.append(task_id)
+        self._emit(logging.INFO, "%d件のタスクを削除しました", removed)
+        self._warn_missing(missing)
+        return removed
+
     def complete_task(self, task_id: int) -> bool:
         """
         タスクを完了にする
@@ -133,11 +1003,34 @@ class TaskManager:
         task = self._find_task_by_id(task_id)
         if task:
             task.complete()
-            print(f"タスクを完了しました: {task.title}")
+            self._emit(logging.INFO, "タスクを完了しました: %s", task.title)
             return True
-        print(f"タスクID {task_id} が見つかりませんでした")
+        self._emit(logging.WARNING, "タスクID %d が見つかりませんでした", task_id)
         return False
 
+    def complete_tasks(self, task_ids: Iterable[int]) -> int:
+        """
+        タスクをまとめて完了にする
+
+        Args:
+            task_ids: タスクIDの列
+
+        Returns:
+            完了にしたタスク数（既に完了済みだったものは含まない）
+        """
+        completed = 0
+        missing = []
+        for task_id in task_ids:
+            task = self._find_task_by_id(task_id)
+            if task is None:
+                missing.append(task_id)
+            elif not task.completed:
+                task.complete()
+                completed += 1
+        self._emit(logging.INFO, "%d件のタスクを完了しました", completed)
+        self._warn_missing(missing)
+        return completed
+
     def get_pending_tasks(self) -> List[Task]:
         """
         未完了タスクを取得
@@ -145,7 +1038,9 @@ class TaskManager:
         Returns:
             未完了タスクのリスト
         """
-        return [task for task in self.tasks if not task.completed]
+        if self._snapshot_rows is not None:
+            self._take_snapshot_rows(self._snapshot_rows.rows_with_status(False))
+        return self._by_status[False].values()
 
     def get_completed_tasks(self) -> List[Task]:
         """
@@ -154,7 +1049,9 @@ class TaskManager:
         Returns:
             完了済みタスクのリスト
         """
-        return [task for task in self.tasks if task.completed]
+        if self._snapshot_rows is not None:
+            self._take_snapshot_rows(self._snapshot_rows.rows_with_status(True))
+        return self._by_status[True].values()
 
     def get_tasks_by_priority(self, priority: Priority) -> List[Task]:
         """
@@ -166,7 +1063,23 @@ class TaskManager:
         Returns:
             指定された優先度のタスクリスト
         """
-        return [task for task in self.tasks if task.priority == priority]
+        if self._snapshot_rows is not None:
+            self._take_snapshot_rows(self._snapshot_rows.rows_with_priority(priority.value))
+        return self._by_priority[priority].values()
+
+    def get_next_tasks(self, n: int = 1) -> List[Task]:
+        """
+        次に着手すべき未完了タスクを取得（優先度の高い順、同じ優先度なら古い順）
+
+        Args:
+            n: 取得件数
+
+        Returns:
+            未完了タスクのリスト（最大n件）
+        """
+        if self._snapshot_rows is not None:
+            self._take_snapshot_rows(self._snapshot_rows.rows_with_status(False))
+        return self._pending_queue.peek(n)
 
     def search_tasks(self, keyword: str) -> List[Task]:
         """
@@ -179,21 +1092,46 @@ class TaskManager:
             検索結果のタスクリスト
         """
         keyword_lower = keyword.lower()
+        tasks = self._all_tasks().values()
+        if self._search_index is not None and len(keyword_lower) >= 2:
+            # 候補を絞り込んでから部分一致を確認する（ID順 = 追加順）
+            tasks = [self._tasks[task_id] for task_id in sorted(self._search_index.candidates(keyword_lower))]
         return [
-            task for task in self.tasks
+            task for task in tasks
             if keyword_lower in task.title.lower() or keyword_lower in task.description.lower()
         ]
 
     def list_tasks(self) -> None:
         """全タスクを表示"""
-        if not self.tasks:
+        tasks = self._all_tasks()
+        if not tasks:
             print("タスクはありません")
             return
 
-        print(f"\n=== タスク一覧（全{len(self.tasks)}件） ===")
-        for task in self.tasks:
+        print(f"\n=== タスク一覧（全{len(tasks)}件） ===")
+        for task in tasks.values():
             print(f"  {task}")
 
+    def _emit(self, level: int, message: str, *args) -> None:
+        """
+        イベントフックに通知（内部メソッド）
+
+        通知しない場合はメッセージの組み立ても行わない
+
+        Args:
+            level: ログレベル
+            message: %形式のメッセージ
+            args: メッセージの引数
+        """
+        if self.event_hook is not None and level >= self.event_level:
+            self.event_hook(level, message % args if args else message)
+
+    def _warn_missing(self, task_ids: List[int]) -> None:
+        """見つからなかったタスクIDをまとめて1件の警告として通知（内部メソッド）"""
+        if task_ids:
+            self._emit(logging.WARNING, "タスクID %s が見つかりませんでした",
+                       ", ".join(map(str, task_ids)))
+
     def _find_task_by_id(self, task_id: int) -> Optional[Task]:
         """
         IDでタスクを検索（内部メソッド）
@@ -204,10 +1142,582 @@ class TaskManager:
         Returns:
             タスクまたはNone
         """
-        for task in self.tasks:
-            if task.id == task_id:
-                return task
-        return None
+        task = self._tasks.get(task_id)
+        if task is None and self._snapshot_rows is not None:
+            task = self._snapshot_rows.take(task_id)
+            if task is not None:
+                self._insert_task(task, record=False)
+                if not self._snapshot_rows:
+                    self._snapshot_rows = None
+        return task
+
+    def _load_snapshot_rows(self, snapshot_rows: _SnapshotRows) -> None:
+        """
+        スナップショットの行を、Taskにしないまま登録（内部メソッド、復元時に呼ばれる）
+
+        Args:
+            snapshot_rows: スナップショットから読み込んだ行
+        """
+        self._snapshot_rows = snapshot_rows if snapshot_rows else None
+        if self._search_index is not None:
+            # 転置インデックスは全タスクのテキストから作るので、先に全てTaskにする
+            self._take_snapshot_rows()
+
+    def _take_snapshot_rows(self, rows: Optional[List[int]] = None) -> None:
+        """
+        スナップショットの行をTaskにして登録（内部メソッド）
+
+        Args:
+            rows: 行番号（省略時はまだTaskにしていない全ての行）
+        """
+        snapshot_rows = self._snapshot_rows
+        if snapshot_rows is None:
+            return
+        with _gc_paused():
+            tasks = snapshot_rows.take_rows(snapshot_rows.rows() if rows is None else rows)
+            self._insert_tasks(tasks, record=False)
+        if not snapshot_rows:
+            self._snapshot_rows = None
+
+    def _all_tasks(self) -> Dict[int, Task]:
+        """全てのタスクをTaskにし、ID順（追加順）に並べた_tasksを返す（内部メソッド）"""
+        self._take_snapshot_rows()
+        if not self._tasks_sorted:
+            # _PendingQueueが同じ辞書を参照しているので、その場で並べ直す
+            with _gc_paused():
+                tasks = self._tasks
+                ordered = {task_id: tasks[task_id] for task_id in sorted(tasks)}
+                tasks.clear()
+                tasks.update(ordered)
+            self._tasks_sorted = True
+        return self._tasks
+
+    def _snapshot_source(self) -> Tuple[Optional[_SnapshotRows], List[int], List[Task]]:
+        """
+        コンパクション用に、現時点の全タスクを表すデータを返す（内部メソッド）
+
+        Returns:
+            (スナップショットの行, まだTaskにしていない行番号, Taskにしたタスクのリスト)
+        """
+        if self._snapshot_rows is None:
+            return None, [], list(self._tasks.values())
+        return self._snapshot_rows, self._snapshot_rows.rows(), list(self._tasks.values())
+
+    def _insert_task(self, task: Task, record: bool = True) -> None:
+        """
+        作成済みのタスクを登録（内部メソッド）
+
+        Args:
+            task: 登録するタスク
+            record: ジャーナルに記録するかどうか（スナップショットの行をTaskにした場合はFalse）
+        """
+        if self._tasks_sorted and self._tasks and task.id < next(reversed(self._tasks)):
+            self._tasks_sorted = False
+        self._tasks[task.id] = task
+        self._by_status[task.completed].add(task)
+        self._by_priority[task.priority].add(task)
+        if self._search_index is not None:
+            self._search_index.add(task)
+        if not task.completed:
+            self._pending_queue.push(task)
+        task._manager = self
+        if record and self._journal is not None:
+            self._journal.record_add(task)
+
+    def _insert_tasks(self, tasks: Iterable[Task], record: bool = True) -> None:
+        """
+        作成済みのタスクをまとめて登録（内部メソッド）
+
+        優先度付きキューは最後に一括で作る
+
+        Args:
+            tasks: 登録するタスク
+            record: ジャーナルに記録するかどうか（スナップショットの行をTaskにした場合はFalse）
+        """
+        by_id = self._tasks
+        by_status = {flag: bucket._tasks for flag, bucket in self._by_status.items()}
+        by_priority = {p.value: bucket._tasks for p, bucket in self._by_priority.items()}
+        journal = self._journal if record else None
+        # 各区分・_tasksの末尾のIDより小さいIDが来たら並べ直しが必要になる
+        last_id = max(
+            (next(reversed(index), 0) for index in itertools.chain(
+                [by_id], by_status.values(), by_priority.values())),
+            default=0,
+        )
+        in_order = True
+        pending = []
+        for task in tasks:
+            if task.id < last_id:
+                in_order = False
+            last_id = task.id
+            by_id[task.id] = task
+            by_status[task.completed][task.id] = task
+            by_priority[task._priority][task.id] = task
+            task._manager = self
+            if not task.completed:
+                pending.append(task)
+            if self._search_index is not None:
+                self._search_index.add(task)
+            if journal is not None:
+                journal.record_add(task)
+        # ID順が崩れていれば取得時に並べ直させる
+        if not in_order:
+            self._tasks_sorted = False
+            for bucket in itertools.chain(self._by_status.values(), self._by_priority.values()):
+                bucket._sorted = False
+        self._pending_queue.push_many(pending)
+
+    def _detach_task(self, task_id: int) -> Optional[Task]:
+        """
+        タスクを全てのインデックスから外す（内部メソッド）
+
+        Args:
+            task_id: タスクID
+
+        Returns:
+            外したタスクまたはNone
+        """
+        if self._find_task_by_id(task_id) is None:
+            return None
+        task = self._tasks.pop(task_id)
+        self._by_status[task.completed].discard(task)
+        self._by_priority[task.priority].discard(task)
+        if self._search_index is not None:
+            self._search_index.discard(task)
+        if not task.completed:
+            self._pending_queue.discard(task)
+        task._manager = None
+        if self._journal is not None:
+            self._journal.record_remove(task)
+        return task
+
+    def _on_status_changed(self, task: Task) -> None:
+        """
+        タスクの完了状態が変わったときにインデックスを更新（内部メソッド）
+
+        Task.complete() / Task.uncomplete() から呼ばれる
+
+        Args:
+            task: 状態が変わったタスク
+        """
+        self._by_status[not task.completed].discard(task)
+        self._by_status[task.completed].add(task)
+        if task.completed:
+            self._pending_queue.discard(task)
+        else:
+            self._pending_queue.push(task)
+        if self._journal is not None:
+            if task.completed:
+                self._journal.record_complete(task)
+            else:
+                self._journal.record_uncomplete(task)
+
+
+class ConcurrentTaskManager:
+    """
+    複数スレッドから共有できるタスクマネージャー
+
+    タスクIDで分割した複数のTaskManager（ストライプ）を持ち、
+    ストライプごとのロックで保護する。別のストライプに属するタスクへの
+    追加・完了・削除は互いにブロックしない。
+    取得系のメソッドは各ストライプの結果をID順（追加順）にマージして返す
+    （ストライプをまたいだ一貫したスナップショットではない）。
+    スレッドから状態を変えるときはTask.complete()を直接呼ばず、
+    complete_task / uncomplete_task を使うこと。
+    GILのあるCPythonでは処理自体は並列に走らないため、ストライプで減らせるのは
+    ロック待ちだけで、1コアの環境ではストライプ数を増やしても速くはならない。
+    """
+
+    def __init__(self, stripes: int = 16, search_index: bool = False):
+        """
+        Args:
+            stripes: ストライプ（ロック）の数
+            search_index: 検索用の転置インデックスを使うかどうか
+        """
+        self._shards = [TaskManager(search_index, event_hook=None) for _ in range(stripes)]
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def _stripe(self, task_id: int) -> Tuple[TaskManager, threading.Lock]:
+        index = task_id % len(self._shards)
+        return self._shards[index], self._locks[index]
+
+    @property
+    def tasks(self) -> Tuple[Task, ...]:
+        """全タスク（ID順、読み取り専用）"""
+        return tuple(self._collect(lambda shard: shard.tasks))
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._shards)
+
+    def __contains__(self, task_id: int) -> bool:
+        return task_id in self._stripe(task_id)[0]
+
+    def add_task(self, title: str, description: str = "", priority: Priority = Priority.MEDIUM) -> Task:
+        """
+        タスクを追加
+
+        Args:
+            title: タイトル
+            description: 説明
+            priority: 優先度
+
+        Returns:
+            作成されたタスク
+        """
+        task = Task(title, description, priority)
+        shard, lock = self._stripe(task.id)
+        with lock:
+            shard._insert_task(task)
+        return task
+
+    def remove_task(self, task_id: int) -> bool:
+        """
+        タスクを削除
+
+        Args:
+            task_id: タスクID
+
+        Returns:
+            削除成功の場合True
+        """
+        shard, lock = self._stripe(task_id)
+        with lock:
+            return shard._detach_task(task_id) is not None
+
+    def complete_task(self, task_id: int) -> bool:
+        """
+        タスクを完了にする
+
+        Args:
+            task_id: タスクID
+
+        Returns:
+            完了成功の場合True
+        """
+        shard, lock = self._stripe(task_id)
+        with lock:
+            task = shard._find_task_by_id(task_id)
+            if task is None:
+                return False
+            task.complete()
+            return True
+
+    def uncomplete_task(self, task_id: int) -> bool:
+        """
+        タスクを未完了に戻す
+
+        Args:
+            task_id: タスクID
+
+        Returns:
+            成功の場合True
+        """
+        shard, lock = self._stripe(task_id)
+        with lock:
+            task = shard._find_task_by_id(task_id)
+            if task is None:
+                return False
+            task.uncomplete()
+            return True
+
+    def _collect(self, query) -> List[Task]:
+        """各ストライプでqueryを実行し、結果をID順にマージ（内部メソッド）"""
+        parts = []
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                parts.append(query(shard))
+        return list(heapq.merge(*parts, key=lambda task: task.id))
+
+    def get_pending_tasks(self) -> List[Task]:
+        """未完了タスクを取得"""
+        return self._collect(lambda shard: shard.get_pending_tasks())
+
+    def get_completed_tasks(self) -> List[Task]:
+        """完了済みタスクを取得"""
+        return self._collect(lambda shard: shard.get_completed_tasks())
+
+    def get_tasks_by_priority(self, priority: Priority) -> List[Task]:
+        """優先度別にタスクを取得"""
+        return self._collect(lambda shard: shard.get_tasks_by_priority(priority))
+
+    def search_tasks(self, keyword: str) -> List[Task]:
+        """タスクを検索（タイトルまたは説明で検索）"""
+        return self._collect(lambda shard: shard.search_tasks(keyword))
+
+    def get_next_tasks(self, n: int = 1) -> List[Task]:
+        """次に着手すべき未完了タスクを取得（優先度の高い順、同じ優先度なら古い順）"""
+        parts = []
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                parts.append(shard.get_next_tasks(n))
+        return list(heapq.merge(*parts, key=_PendingQueue._entry))[:n]
+
+
+def stress_test_concurrent_manager(manager: ConcurrentTaskManager, workers: int = 8, per_worker: int = 5_000) -> float:
+    """
+    複数スレッドから同時に追加・完了・削除し、IDの重複やタスクの消失がないか確認
+
+    各ワーカーはper_worker件を追加し、偶数番目を完了、4の倍数番目を削除する。
+
+    Args:
+        manager: 検証するタスクマネージャー（空の状態で渡す）
+        workers: スレッド数
+        per_worker: 1スレッドあたりの追加件数
+
+    Returns:
+        かかった時間（秒）
+    """
+
+    def work(worker: int) -> List[int]:
+        ids = []
+        for i in range(per_worker):
+            task = manager.add_task(f"w{worker}-{i}")
+            ids.append(task.id)
+            if i % 2 == 0:
+                assert manager.complete_task(task.id)
+            if i % 4 == 0:
+                assert manager.remove_task(task.id)
+        return ids
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(work, range(workers)))
+    elapsed = time.perf_counter() - start
+
+    all_ids = [task_id for ids in results for task_id in ids]
+    assert len(all_ids) == len(set(all_ids)), "IDが重複しています"
+    removed = workers * len(range(0, per_worker, 4))
+    completed = workers * len(range(0, per_worker, 2)) - removed
+    assert len(manager) == workers * per_worker - removed, "タスクが失われています"
+    assert len(manager.get_completed_tasks()) == completed
+    assert len(manager.get_pending_tasks()) == len(manager) - completed
+    return elapsed
+
+
+def benchmark_task_manager(sizes: tuple = (1_000, 10_000, 100_000, 1_000_000), ops: int = 1_000) -> None:
+    """
+    タスク数を変えてcomplete_task / remove_taskの1操作あたりの時間を計測
+
+    IDインデックスによりタスク数に関係なくほぼ一定時間になることを確認する。
+    末尾のタスクを対象にするため、線形探索なら最も遅くなるケースになる。
+
+    Args:
+        sizes: 計測するタスク数
+        ops: 計測する操作回数
+    """
+    print("\n=== ベンチマーク: complete_task / remove_task ===")
+    for size in sizes:
+        manager = TaskManager(event_hook=None)
+        manager.add_tasks((f"タスク{i}",) for i in range(size))
+        target_ids = [task.id for task in manager.tasks[-ops:]]
+
+        start = time.perf_counter()
+        for task_id in target_ids:
+            manager.complete_task(task_id)
+        complete_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for task_id in target_ids:
+            manager.remove_task(task_id)
+        remove_elapsed = time.perf_counter() - start
+
+        print(
+            f"  {size:>9,}件: complete {complete_elapsed / ops * 1e6:6.2f}µs/回, "
+            f"remove {remove_elapsed / ops * 1e6:6.2f}µs/回"
+        )
+
+
+
+def benchmark_search(size: int, repeat: int = 20) -> None:
+    """
+    search_tasksの線形探索と転置インデックスの速度を比較
+
+    Args:
+        size: タスク数
+        repeat: 各キーワードの検索回数
+    """
+    print(f"\n=== ベンチマーク: search_tasks（{size:,}件） ===")
+    words = ["設計", "レビュー", "テスト", "ドキュメント", "デプロイ", "調査", "修正", "Refactor"]
+    plain = TaskManager()
+    indexed = TaskManager(search_index=True)
+    for i in range(size):
+        title = f"{words[i % len(words)]}{i}"
+        description = f"{words[(i * 7) % len(words)]}を担当者{i % 97}が行う"
+        plain._insert_task(Task(title, description))
+        indexed._insert_task(Task(title, description))
+
+    for keyword in ["レビュー", "refactor", "担当者42", "存在しない語"]:
+        results = {}
+        for name, manager in (("線形探索", plain), ("転置インデックス", indexed)):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                found = manager.search_tasks(keyword)
+            elapsed = (time.perf_counter() - start) / repeat
+            results[name] = (elapsed, len(found))
+        print(
+            f"  「{keyword}」{results['線形探索'][1]:>7,}件: "
+            f"線形探索 {results['線形探索'][0] * 1e3:7.2f}ms, "
+            f"転置インデックス {results['転置インデックス'][0] * 1e3:7.2f}ms"
+        )
+
+
+def benchmark_next_tasks(size: int, rounds: int = 200) -> None:
+    """
+    get_next_tasksとget_pending_tasksのソートで次のタスクを選ぶ速度を比較
+
+    毎回、先頭のタスクを完了して新しいタスクを追加する（入れ替わりが激しい状況）
+
+    Args:
+        size: 未完了タスク数
+        rounds: 「次のタスクを選んで完了」を繰り返す回数
+    """
+    print(f"\n=== ベンチマーク: 次のタスクの選択（{size:,}件） ===")
+    priorities = list(Priority)
+    for name in ("ソート", "ヒープ"):
+        manager = TaskManager()
+        for i in range(size):
+            manager._insert_task(Task(f"タスク{i}", priority=priorities[i % 3]))
+        start = time.perf_counter()
+        for i in range(rounds):
+            if name == "ソート":
+                pending = sorted(
+                    manager.get_pending_tasks(),
+                    key=lambda t: (-t.priority.value, t.created_at, t.id),
+                )
+                task = pending[0]
+            else:
+                task = manager.get_next_tasks()[0]
+            task.complete()
+            manager._insert_task(Task(f"追加{i}", priority=priorities[i % 3]))
+        elapsed = time.perf_counter() - start
+        print(f"  {name}: {elapsed / rounds * 1e6:10.2f}µs/回")
+
+
+def benchmark_task_memory(size: int) -> None:
+    """
+    タスク1件あたりのメモリ使用量を比較（tracemallocで計測）
+
+    - 従来の形式: __dict__に日時2つ・Enum・文字列2つを持つクラス
+    - Task: __slots__ + エポック秒 + 整数の優先度
+    - TaskStore: 列ごとの配列
+
+    Args:
+        size: 作成するタスク数
+    """
+
+    class DictTask:
+        """変更前と同じレイアウトのタスク（比較用）"""
+
+        def __init__(self, task_id: int, title: str, description: str, priority: Priority):
+            self.id = task_id
+            self.title = title
+            self.description = description
+            self.priority = priority
+            self.completed = False
+            self.created_at = datetime.now()
+            self.completed_at: Optional[datetime] = None
+
+    def measure(build) -> float:
+        gc.collect()
+        tracemalloc.start()
+        objects = build()
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del objects
+        return current / size
+
+    def build_dict_tasks():
+        return [DictTask(i, f"タスク{i}", f"説明{i}", Priority.MEDIUM) for i in range(size)]
+
+    def build_tasks():
+        return [Task(f"タスク{i}", f"説明{i}") for i in range(size)]
+
+    def build_store():
+        return TaskStore.from_tasks(Task(f"タスク{i}", f"説明{i}") for i in range(size))
+
+    print(f"\n=== ベンチマーク: タスク1件あたりのメモリ（{size:,}件、文字列を含む） ===")
+    for name, build in (("従来の形式", build_dict_tasks), ("Task(__slots__)", build_tasks), ("TaskStore", build_store)):
+        print(f"  {name:<16}: {measure(build):7.1f} bytes/件")
+
+
+def benchmark_journal_recovery(size: int, tail: int = 10_000) -> None:
+    """
+    スナップショット + ジャーナル末尾からの復元時間と、コンパクション中の変更の待ち時間を計測
+
+    Args:
+        size: スナップショットに含めるタスク数
+        tail: スナップショット後にジャーナルへ記録する変更数
+    """
+    print(f"\n=== ベンチマーク: ジャーナルからの復元（{size:,}件 + 変更{tail:,}件） ===")
+    with tempfile.TemporaryDirectory() as directory:
+        journal = TaskJournal(directory, compact_every=None)
+        manager = TaskManager(journal=journal, event_hook=None)
+        manager.add_tasks((f"タスク{i}", f"説明{i}") for i in range(size))
+        start = time.perf_counter()
+        journal.compact()
+        print(f"  スナップショット作成: {time.perf_counter() - start:.2f}秒 "
+              f"({os.path.getsize(journal.snapshot_path) / 1e6:.1f}MB)")
+        for task in manager.tasks[:tail]:
+            task.complete()
+        journal.close()
+        del manager
+
+        start = time.perf_counter()
+        restored_journal = TaskJournal(directory, compact_every=tail)
+        restored = TaskManager(journal=restored_journal, event_hook=None)
+        print(f"  TaskManagerの復元: {time.perf_counter() - start:.2f}秒")
+        assert len(restored) == size
+
+        # compact_every件目の変更でコンパクションが始まる（書き出しはスレッドで行う）
+        latencies = []
+        for i in range(tail):
+            start = time.perf_counter()
+            restored.add_task(f"追加{i}")
+            latencies.append(time.perf_counter() - start)
+        print(f"  コンパクションを挟んだadd_task: 最大 {max(latencies) * 1000:.1f}ms"
+              f"（書き出し中: {restored_journal.compacting}）")
+        restored_journal.wait_for_compaction()
+
+        start = time.perf_counter()
+        completed = restored.get_completed_tasks()
+        print(f"  最初のget_completed_tasks（{len(completed):,}件をTaskにする）: "
+              f"{time.perf_counter() - start:.2f}秒")
+        start = time.perf_counter()
+        pending = restored.get_pending_tasks()
+        print(f"  最初のget_pending_tasks（{len(pending):,}件をTaskにする）: "
+              f"{time.perf_counter() - start:.2f}秒")
+        assert len(completed) == tail and len(pending) == size
+        restored_journal.close()
+
+
+def benchmark_bulk_add(size: int) -> None:
+    """
+    add_taskの繰り返しとadd_tasksの一括追加を比較
+
+    Args:
+        size: 追加するタスク数
+    """
+    print(f"\n=== ベンチマーク: タスクの追加（{size:,}件） ===")
+    items = [(f"タスク{i}", f"説明{i}", Priority.MEDIUM) for i in range(size)]
+
+    def single(manager: TaskManager) -> None:
+        for item in items:
+            manager.add_task(*item)
+
+    def bulk(manager: TaskManager) -> None:
+        manager.add_tasks(items)
+
+    for name, event_hook, add in (
+        ("add_task（イベントをprint）", print_event, single),
+        ("add_task（イベントなし）", None, single),
+        ("add_tasks", None, bulk),
+    ):
+        manager = TaskManager(event_hook=event_hook)
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            add(manager)
+            elapsed = time.perf_counter() - start
+        print(f"  {name:<24}: {elapsed:.3f}秒 ({size / elapsed:,.0f}件/秒)")
 
 
 # テストコード
@@ -272,5 +1782,208 @@ if __name__ == "__main__":
     assert len(manager.get_pending_tasks()) == 2
     assert len(manager.get_completed_tasks()) == 2
     assert len(manager.tasks) == 4  # 1つ削除したので4つ
+    assert len(manager) == 4
+    try:
+        manager.tasks.append(task4)
+        raise AssertionError("tasksは変更できないはず")
+    except AttributeError:
+        pass
+
+    # Task側で直接状態を変えてもインデックスに反映される
+    task1.uncomplete()
+    assert [t.id for t in manager.get_pending_tasks()] == [task1.id, task2.id, task5.id]
+    assert [t.id for t in manager.get_completed_tasks()] == [task3.id]
+    task2.complete()
+    assert [t.id for t in manager.get_completed_tasks()] == [task2.id, task3.id]
+    assert task4 not in manager.get_tasks_by_priority(Priority.LOW)
+
+    # 優先度付きキュー: 優先度の高い順、同じ優先度なら古い順
+    assert manager.get_next_tasks(2) == [task1, task5]
+    task1.complete()
+    assert manager.get_next_tasks() == [task5]
+    task1.uncomplete()
+    assert manager.get_next_tasks(10) == [task1, task5]
+
+    # 日時・優先度は元の型で参照できる
+    assert task1.priority is Priority.HIGH
+    assert isinstance(task2.created_at, datetime) and isinstance(task2.completed_at, datetime)
+    assert task1.completed_at is None
+    assert not hasattr(task1, "__dict__")
+
+    # カラムナストアとの相互変換
+    store = TaskStore.from_tasks(manager.tasks)
+    assert len(store) == len(manager)
+    for original, restored in zip(manager.tasks, store):
+        assert (restored.id, restored.title, restored.priority, restored.completed) == \
+            (original.id, original.title, original.priority, original.completed)
+        assert restored.created_at == original.created_at
+        assert restored.completed_at == original.completed_at
+
+    # 複数スレッドから同時に操作してもIDの重複・タスクの消失がない
+    stress_test_concurrent_manager(ConcurrentTaskManager())
+    concurrent = ConcurrentTaskManager(stripes=4)
+    added = [concurrent.add_task(t.title, t.description, t.priority) for t in manager.tasks]
+    concurrent.complete_task(added[0].id)
+    assert list(concurrent.tasks) == added
+    assert concurrent.get_pending_tasks() == added[1:]
+    assert concurrent.get_next_tasks(2) == sorted(added[1:], key=lambda t: (-t.priority.value, t.id))[:2]
+
+    # ジャーナルから再起動後の状態を復元できる
+    with tempfile.TemporaryDirectory() as directory:
+        journal = TaskJournal(directory, sync_every=2, compact_every=4)
+        durable = TaskManager(journal=journal, event_hook=None)
+        for task in manager.tasks:
+            durable.add_task(task.title, task.description, task.priority)
+        durable.complete_task(durable.tasks[1].id)
+        durable.tasks[1].uncomplete()
+        durable.complete_task(durable.tasks[2].id)
+        durable.remove_task(durable.tasks[0].id)
+        durable.add_task("ジャーナルの末尾", priority=Priority.HIGH)
+        journal.close()
+        expected = [(t.id, t.title, t.priority, t.completed, t.created_at, t.completed_at) for t in durable.tasks]
+
+        restored_journal = TaskJournal(directory)
+        restored = TaskManager(journal=restored_journal)
+        assert [(t.id, t.title, t.priority, t.completed, t.created_at, t.completed_at)
+                for t in restored.tasks] == expected
+        assert restored.get_pending_tasks() == [t for t in restored.tasks if not t.completed]
+        assert restored.get_next_tasks()[0].title == "ジャーナルの末尾"
+        assert Task("新しいタスク").id > max(t.id for t in restored.tasks)
+        restored_journal.close()
+
+    # 書き込み途中で止まった行があっても、その後の追記が失われない
+    with tempfile.TemporaryDirectory() as directory:
+        journal = TaskJournal(directory, sync_every=1, compact_every=None)
+        torn = TaskManager(journal=journal, event_hook=None)
+        torn.add_task("a")
+        torn.add_task("b")
+        journal.close()
+        with open(os.path.join(directory, TaskJournal.JOURNAL_FILE), "a", encoding="utf-8") as f:
+            f.write('["a",99,"tor')
+        for titles in (["c", "d"], []):
+            journal = TaskJournal(directory, sync_every=1, compact_every=None)
+            torn = TaskManager(journal=journal, event_hook=None)
+            for title in titles:
+                torn.add_task(title)
+            journal.close()
+        assert [t.title for t in torn.tasks] == ["a", "b", "c", "d"]
+
+    # スナップショットのタスクは使われたときにTaskになる（結果は全てTaskにした場合と同じ）
+    with tempfile.TemporaryDirectory() as directory:
+        journal = TaskJournal(directory, compact_every=None)
+        lazy = TaskManager(journal=journal, event_hook=None)
+        lazy.add_tasks([(f"タスク{i}", f"説明{i}", list(Priority)[i % 3]) for i in range(10)])
+        lazy.complete_task(lazy.tasks[3].id)
+        journal.compact()
+        lazy.complete_task(lazy.tasks[5].id)
+        journal.close()
+        ids = [t.id for t in lazy.tasks]
+        expected = [(t.id, t.title, t.priority, t.completed, t.created_at, t.completed_at) for t in lazy.tasks]
+
+        journal = TaskJournal(directory, compact_every=None)
+        lazy = TaskManager(journal=journal, event_hook=None)
+        assert len(lazy) == 10 and ids[0] in lazy and len(lazy._snapshot_rows) == 9  # 5番目だけTaskになった
+        task = lazy._find_task_by_id(ids[7])
+        assert task.title == "タスク7" and lazy._find_task_by_id(ids[7]) is task
+        assert lazy.complete_tasks([ids[1], ids[3]]) == 1
+        assert lazy.remove_task(ids[2]) and ids[2] not in lazy and len(lazy) == 9
+        assert [t.id for t in lazy.get_tasks_by_priority(Priority.HIGH)] == [ids[i] for i in (5, 8)]
+        assert [t.id for t in lazy.get_next_tasks(3)] == [ids[i] for i in (8, 4, 7)]
+        assert task in lazy.get_pending_tasks()
+        assert [t.id for t in lazy.tasks] == [i for i in ids if i != ids[2]] and lazy._snapshot_rows is None
+        expected = [(t.id, t.title, t.priority, t.completed, t.created_at, t.completed_at) for t in lazy.tasks]
+        journal.close()
+        journal = TaskJournal(directory, compact_every=None)
+        assert [(t.id, t.title, t.priority, t.completed, t.created_at, t.completed_at)
+                for t in TaskManager(journal=journal, event_hook=None).tasks] == expected
+        journal.close()
+
+    # スナップショットの書き出しは変更の呼び出しの外（スレッド）で行い、
+    # 書き出し中に止まって切り替え前のジャーナルが残っていても、同じ記録が重なっていても復元できる
+    with tempfile.TemporaryDirectory() as directory:
+        journal = TaskJournal(directory, sync_every=1, compact_every=3)
+        background = TaskManager(journal=journal, event_hook=None)
+        for title in "abcdefg":
+            background.add_task(title)
+        background.complete_task(background.tasks[0].id)
+        background.remove_task(background.tasks[1].id)
+        journal.close()
+        assert not os.path.exists(journal.previous_journal_path)
+        journal = TaskJournal(directory, compact_every=None)
+        background = TaskManager(journal=journal, event_hook=None)
+        background.complete_task(background.add_task("h").id)
+        background.complete_task(background.tasks[2].id)
+        journal.close()
+        expected = [(t.id, t.title, t.completed) for t in background.tasks]
+        with open(journal.journal_path, encoding="utf-8") as f:
+            lines = f.readlines()
+        assert len(lines) == 3
+        # 切り替え前のジャーナルだけが残った状態と、新しいジャーナルと記録が重なった状態
+        for overlap in (0, 2):
+            with open(journal.previous_journal_path, "w", encoding="utf-8") as f:
+                f.writelines(lines)
+            with open(journal.journal_path, "w", encoding="utf-8") as f:
+                f.writelines(lines[len(lines) - overlap:])
+            journal = TaskJournal(directory, compact_every=None)
+            background = TaskManager(journal=journal, event_hook=None)
+            assert [(t.id, t.title, t.completed) for t in background.tasks] == expected
+            assert not os.path.exists(journal.previous_journal_path)
+            journal.close()
+            with open(journal.journal_path, encoding="utf-8") as f:
+                lines = f.readlines()
+        # スナップショットを書き終え、切り替え前のジャーナルを消す前に止まった状態
+        journal = TaskJournal(directory, compact_every=None)
+        TaskManager(journal=journal, event_hook=None)
+        journal.compact()
+        journal.close()
+        with open(journal.previous_journal_path, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+        journal = TaskJournal(directory, compact_every=None)
+        assert [(t.id, t.title, t.completed) for t in TaskManager(journal=journal, event_hook=None).tasks] == expected
+        journal.close()
+
+    # 転置インデックスを使っても検索結果は変わらない
+    indexed = TaskManager(search_index=True, event_hook=None)
+    for task in [*manager.tasks, task4]:
+        indexed.add_task(task.title, task.description, task.priority)
+    indexed.add_task("README更新", "Readmeの誤字を直す", Priority.LOW)
+    indexed.remove_task(indexed.tasks[0].id)
+    plain = TaskManager(event_hook=None)
+    for task in indexed.tasks:
+        plain.add_task(task.title, task.description, task.priority)
+    for keyword in ["テスト", "ト", "", "readme", "ER図", "api仕様", "存在しない", "レビュー"]:
+        expected = [t.title for t in plain.search_tasks(keyword)]
+        assert [t.title for t in indexed.search_tasks(keyword)] == expected, keyword
+
+    # 一括操作とイベントフック
+    events = []
+    bulk = TaskManager(event_hook=lambda level, message: events.append((level, message)),
+                       event_level=logging.WARNING)
+    added = bulk.add_tasks([("A",), ("B", "説明"), ("C", "", Priority.HIGH)])
+    assert [t.title for t in bulk.get_next_tasks(3)] == ["C", "A", "B"]
+    assert bulk.complete_tasks([added[0].id, added[1].id, 999_999]) == 2
+    assert bulk.complete_tasks([added[0].id]) == 0  # 既に完了済みなので数えない
+    assert bulk.get_pending_tasks() == [added[2]]
+    assert bulk.remove_tasks([added[1].id, added[2].id, 999_998]) == 2
+    assert bulk.tasks == (added[0],) and bulk.get_next_tasks() == []
+    assert not bulk.complete_task(999_999)
+    assert events == [
+        (logging.WARNING, "タスクID 999999 が見つかりませんでした"),
+        (logging.WARNING, "タスクID 999998 が見つかりませんでした"),
+        (logging.WARNING, "タスクID 999999 が見つかりませんでした"),
+    ]
 
     print("\n全てのテストが成功しました！")
+
+    # ベンチマーク: python solution_10.py --bench
+    if "--bench" in sys.argv:
+        benchmark_task_manager()
+        benchmark_bulk_add(100_000)
+        benchmark_search(100_000)
+        benchmark_next_tasks(100_000)
+        benchmark_task_memory(100_000)
+        print("\n=== ベンチマーク: ConcurrentTaskManager（8スレッド × 50,000件） ===")
+        for stripes in (1, 16):
+            elapsed = stress_test_concurrent_manager(ConcurrentTaskManager(stripes), 8, 50_000)
+            print(f"  ストライプ数 {stripes:>2}: {elapsed:.2f}秒")
+        benchmark_journal_recovery(1_000_000)
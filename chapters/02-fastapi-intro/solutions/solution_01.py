@@ -2,7 +2,17 @@
 問題1の模範解答: Hello World API
 """
 
-from fastapi import FastAPI
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
 
 app = FastAPI()
 
@@ -23,6 +33,256 @@ def health_check():
     }
 
 
+# ---------------------------------------------------------------------------
+# CPUプロファイリング（オプトイン）
+#
+# 一部のリクエスト（sample_rateの割合、またはデバッグ用ヘッダー付き）の処理中だけ
+# 別スレッドから一定間隔でスタックを採取し、メモリ上で集計する。
+# 再起動せずに本番のトラフィックを調べられるよう、サンプリング率は管理用
+# エンドポイントから変更できる。管理用エンドポイントには認証用の依存関係が必須で、
+# デバッグ用ヘッダーも設定した秘密の値が付いている場合だけ有効にする。
+# ---------------------------------------------------------------------------
+
+# 待機中のスレッド（ロック待ち・I/O待ち）のスタックの末端になる関数。既定では集計から除く
+_IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+}
+
+
+class StackSampler:
+    """
+    プロファイル対象のリクエストを処理している間、全スレッドのスタックを定期的に採取する
+
+    非同期のエンドポイントはイベントループのスレッド、同期のエンドポイントは
+    スレッドプールで実行されるため、採取中は（自分以外の）全スレッドを対象にする。
+    同時に処理されている他のリクエストのスタックも含まれる点に注意。
+    """
+
+    def __init__(self, sample_rate: float = 0.0, interval: float = 0.005, max_stacks: int = 10_000,
+                 include_idle: bool = False):
+        """
+        Args:
+            sample_rate: プロファイルするリクエストの割合（0〜1）
+            interval: 採取間隔（秒）
+            max_stacks: 保持する異なるスタックの最大数（超えた分は"[truncated]"にまとめる）
+            include_idle: 待機中のスレッドのスタックも集計するか
+        """
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.include_idle = include_idle
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.profiled_requests = 0
+        self._active = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def begin(self) -> None:
+        """プロファイル対象のリクエストの開始"""
+        with self._lock:
+            self._active += 1
+            self.profiled_requests += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def end(self) -> None:
+        """プロファイル対象のリクエストの終了"""
+        with self._lock:
+            self._active -= 1
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while True:
+            if not self._active:
+                # 対象のリクエストがない間は止まっている（CPUを使わない）
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self._record(frame)
+            time.sleep(self.interval)
+
+    def _record(self, frame) -> None:
+        leaf = frame.f_code
+        if not self.include_idle and (Path(leaf.co_filename).name, leaf.co_name) in _IDLE_FRAMES:
+            return
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+            frame = frame.f_back
+        key = tuple(reversed(stack))
+        with self._lock:
+            if key not in self.stacks and len(self.stacks) >= self.max_stacks:
+                key = ("[truncated]",)
+            self.stacks[key] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        """flame graph用のcollapsed stack形式（"呼び出し元;...;関数 サンプル数"）"""
+        with self._lock:
+            items = self.stacks.most_common()
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in items)
+
+    def top_functions(self, n: int = 20) -> list[dict]:
+        """
+        サンプル数の多い関数
+
+        Args:
+            n: 件数
+
+        Returns:
+            self（その関数自身を実行中）とtotal（呼び出し先を含む）のサンプル数
+        """
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        with self._lock:
+            items = list(self.stacks.items())
+        for stack, count in items:
+            self_counts[stack[-1]] += count
+            for function in set(stack):
+                total_counts[function] += count
+        return [
+            {"function": function, "self": self_counts[function], "total": total}
+            for function, total in total_counts.most_common(n)
+        ]
+
+    def reset(self) -> None:
+        """集計結果を消す"""
+        with self._lock:
+            self.stacks.clear()
+            self.samples = 0
+            self.profiled_requests = 0
+
+
+class ProfilingMiddleware:
+    """
+    一部のリクエストだけStackSamplerでプロファイルするASGIミドルウェア
+
+    sample_rateの割合で無作為に選んだリクエストと、
+    debug_headerの値がdebug_tokenと一致するリクエストを対象にする
+    （debug_tokenがNoneならヘッダーは無視する）
+    """
+
+    def __init__(self, app, sampler: StackSampler, debug_token: str | None = None,
+                 debug_header: str = "x-debug-profile"):
+        self.app = app
+        self.sampler = sampler
+        self.debug_token = debug_token.encode() if debug_token else None
+        self.debug_header = debug_header.lower().encode("latin-1")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+        self.sampler.begin()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.sampler.end()
+
+    def _should_profile(self, scope) -> bool:
+        if self.debug_token is not None:
+            for name, value in scope["headers"]:
+                if name == self.debug_header and hmac.compare_digest(value, self.debug_token):
+                    return True
+        rate = self.sampler.sample_rate
+        return rate > 0 and random.random() < rate
+
+
+def require_admin_token(token: str):
+    """
+    X-Admin-Tokenヘッダーがtokenと一致するリクエストだけを通す依存関係を作る
+
+    Args:
+        token: 管理用の秘密の値
+
+    Returns:
+        Depends()に渡す関数
+    """
+    async def check_admin_token(x_admin_token: str | None = Header(None)) -> None:
+        if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode(), token.encode()):
+            raise HTTPException(status_code=403, detail="Forbidden")
+    return check_admin_token
+
+
+def install_profiler(target: FastAPI, *, dependencies: list, sample_rate: float = 0.0,
+                     debug_token: str | None = None, debug_header: str = "x-debug-profile",
+                     admin_path: str = "/admin/profile", interval: float = 0.005) -> StackSampler:
+    """
+    アプリにプロファイリング用のミドルウェアと管理用エンドポイントを追加
+
+    管理用エンドポイントはスタック（内部の実装）を見せ、プロファイルの対象も変えられるため、
+    dependenciesに認証用の依存関係を必ず渡すこと（空のリストを渡すと誰でもアクセスできる）。
+
+    管理用エンドポイント:
+    - GET    {admin_path}/collapsed : collapsed stack形式の集計結果
+    - GET    {admin_path}/top?n=20  : サンプル数の多い関数
+    - PUT    {admin_path}/config?sample_rate=0.01 : サンプリング率の変更
+    - DELETE {admin_path}           : 集計結果のリセット
+
+    Args:
+        target: 対象のFastAPIアプリ
+        dependencies: 管理用エンドポイントに付ける依存関係（例: [Depends(require_admin_token(...))]）
+        sample_rate: プロファイルするリクエストの割合（0〜1）
+        debug_token: debug_headerの値がこれと一致するリクエストは必ずプロファイルする（Noneなら無効）
+        debug_header: デバッグ用ヘッダーの名前
+        admin_path: 管理用エンドポイントのパス
+        interval: スタックの採取間隔（秒）
+
+    Returns:
+        集計結果を持つStackSampler
+    """
+    sampler = StackSampler(sample_rate=sample_rate, interval=interval)
+    target.add_middleware(ProfilingMiddleware, sampler=sampler, debug_token=debug_token,
+                          debug_header=debug_header)
+
+    @target.get(f"{admin_path}/collapsed", response_class=PlainTextResponse, include_in_schema=False,
+                dependencies=dependencies)
+    def profile_collapsed():
+        return sampler.collapsed()
+
+    @target.get(f"{admin_path}/top", include_in_schema=False, dependencies=dependencies)
+    def profile_top(n: int = Query(20, ge=1, le=1000)):
+        return {
+            "samples": sampler.samples,
+            "profiled_requests": sampler.profiled_requests,
+            "sample_rate": sampler.sample_rate,
+            "functions": sampler.top_functions(n),
+        }
+
+    @target.put(f"{admin_path}/config", include_in_schema=False, dependencies=dependencies)
+    def profile_config(sample_rate: float = Query(..., ge=0.0, le=1.0)):
+        sampler.sample_rate = sample_rate
+        return {"sample_rate": sampler.sample_rate}
+
+    @target.delete(admin_path, include_in_schema=False, dependencies=dependencies)
+    def profile_reset():
+        sampler.reset()
+        return {"status": "reset"}
+
+    return sampler
+
+
+# PROFILE_SAMPLE_RATE（例: 0.01 で1%のリクエスト）と PROFILE_ADMIN_TOKEN（管理用エンドポイントの
+# 秘密の値）の両方を設定した場合だけプロファイラーを有効にする
+# PROFILE_DEBUG_TOKEN を設定すると、X-Debug-Profile ヘッダーがその値のリクエストは必ずプロファイルする
+if os.getenv("PROFILE_SAMPLE_RATE") is not None and os.getenv("PROFILE_ADMIN_TOKEN"):
+    profiler = install_profiler(
+        app,
+        dependencies=[Depends(require_admin_token(os.environ["PROFILE_ADMIN_TOKEN"]))],
+        sample_rate=float(os.environ["PROFILE_SAMPLE_RATE"]),
+        debug_token=os.getenv("PROFILE_DEBUG_TOKEN"),
+    )
+
+
 # 実行方法:
 # uvicorn solution_01:app --reload
 #
@@ -30,6 +290,12 @@ def health_check():
 # curl http://localhost:8000/
 # curl http://localhost:8000/health
 #
+# プロファイリング（PROFILE_SAMPLE_RATE=0 PROFILE_ADMIN_TOKEN=... PROFILE_DEBUG_TOKEN=... で起動）:
+# curl -H "X-Debug-Profile: $PROFILE_DEBUG_TOKEN" http://localhost:8000/
+# curl -H "X-Admin-Token: $PROFILE_ADMIN_TOKEN" http://localhost:8000/admin/profile/top
+# curl -H "X-Admin-Token: $PROFILE_ADMIN_TOKEN" http://localhost:8000/admin/profile/collapsed > stacks.txt
+# flamegraph.pl stacks.txt > flame.svg
+#
 # ドキュメント:
 # http://localhost:8000/docs
 
@@ -8,13 +8,41 @@ JWTトークンを使った完全な認証システム
 3. Optional[str] → str | None に変更（Python 3.10+）
 """
 
+import asyncio
+import base64
+import hashlib
+import hmac
+import tempfile
+import importlib.util
+import json
+import math
+import multiprocessing
 import os
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import AsyncIterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager, nullcontext
 from datetime import datetime, timedelta, timezone
-from fastapi import FastAPI, Depends, HTTPException, status
+from pathlib import Path
+from urllib.parse import parse_qs
+from fastapi import BackgroundTasks, FastAPI, Depends, HTTPException, Request, status
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from starlette.datastructures import Headers
 from jose import JWTError, jwt
+from jose.exceptions import ExpiredSignatureError, JWTClaimsError
 from passlib.context import CryptContext
 from pydantic import BaseModel
+from sqlalchemy import Boolean, String, bindparam, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 # 設定
 # 本番環境では必ず環境変数から読み込む
@@ -23,22 +51,85 @@ SECRET_KEY = os.getenv("SECRET_KEY", "development-secret-key-change-in-productio
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# 署名鍵のキーリング（鍵のローテーション用）
+# 例: JWT_KEYS="2026-09:secret-a,2026-10:secret-b"（最後の鍵で署名し、全ての鍵で検証する）
+# 未設定ならSECRET_KEYだけを使う
+JWT_KEYS = os.getenv("JWT_KEYS", "")
+# kidのないトークン（キーリング導入前にjoseで発行したもの）を検証する鍵のkid（既定はJWT_KEYSの最初の鍵）
+JWT_LEGACY_KID = os.getenv("JWT_LEGACY_KID", "")
+
 # 本番環境では環境変数が必須
 if SECRET_KEY == "development-secret-key-change-in-production":
     print("⚠️ 警告: 本番環境ではSECRET_KEY環境変数を設定してください")
 
 # パスワードハッシュ化の設定
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# 新しく作るハッシュのbcryptのコスト
+# BCRYPT_TARGET_MS を設定した場合は起動時にこのCPUで計測して決める（calibrate_bcrypt_rounds）
+bcrypt_rounds = int(os.getenv("BCRYPT_ROUNDS", "12"))
 
 # OAuth2設定
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """アプリケーションのライフサイクル管理"""
+    global bcrypt_rounds
+    if os.getenv("BCRYPT_TARGET_MS"):
+        bcrypt_rounds = calibrate_bcrypt_rounds(float(os.environ["BCRYPT_TARGET_MS"]))
+        print(f"bcryptのコストを{bcrypt_rounds}に設定しました")
+    # 起動時にユーザーの保存先を準備し、デフォルトユーザーを登録する
+    await user_repository.init()
+    for user_dict in fake_users_db.values():
+        await user_repository.add(UserInDB(**user_dict))
+    refresh_task = None
+    if USERNAME_FILTER_ENABLED:
+        await rebuild_username_filter()
+        refresh_task = asyncio.create_task(refresh_username_filter_periodically())
+    yield
+    if refresh_task is not None:
+        refresh_task.cancel()
+    # 終了時にパスワードハッシュ用のプロセスプールとDB接続を閉じる
+    password_hasher.shutdown()
+    await user_repository.close()
+
+
 app = FastAPI(
     title="認証システムデモ",
-    description="JWT認証の学習用アプリケーション"
+    description="JWT認証の学習用アプリケーション",
+    lifespan=lifespan,
 )
 
 
+def _load_solution(chapter: str, filename: str):
+    """他の章の解答ファイルをモジュールとして読み込む"""
+    path = Path(__file__).resolve().parents[2] / chapter / "solutions" / filename
+    spec = importlib.util.spec_from_file_location(f"{chapter}_{Path(filename).stem}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# リクエストのトレース（TRACE_REQUESTS=1 のときだけ有効）
+# 第1章 問題8のTracerを使い、bcryptの検証・JWTのデコード・ユーザー検索の時間を記録する
+tracer = (_load_solution("01-python-basics", "solution_08.py").Tracer()
+          if os.getenv("TRACE_REQUESTS") == "1" else None)
+
+
+def trace_span(name: str):
+    """トレースが有効ならスパンを、無効なら何もしないコンテキストマネージャーを返す"""
+    return tracer.span(name) if tracer is not None else nullcontext()
+
+
+if tracer is not None:
+    @app.middleware("http")
+    async def trace_requests(request: Request, call_next):
+        """リクエスト全体をルートスパンにする"""
+        async with tracer.span(f"{request.method} {request.url.path}"):
+            return await call_next(request)
+
+
 # データモデル（Python 3.10+ の型ヒント）
 class Token(BaseModel):
     access_token: str
@@ -79,35 +170,730 @@ fake_users_db = {
 }
 
 
+# ユーザーの保存先
+class UserRepository(ABC):
+    """ユーザーの保存先のインターフェース（全て非同期でイベントループを止めない）"""
+
+    async def init(self) -> None:
+        """テーブルの作成など、使い始める前の準備"""
+
+    @abstractmethod
+    async def get_by_username(self, username: str) -> UserInDB | None:
+        """ユーザー名でユーザーを取得（存在しなければNone）"""
+        pass
+
+    @abstractmethod
+    async def add(self, user: UserInDB) -> bool:
+        """
+        ユーザーを追加
+
+        Returns:
+            追加できたか（同じユーザー名が既に存在すればFalse）
+        """
+        pass
+
+    @abstractmethod
+    async def set_disabled(self, username: str, disabled: bool = True) -> bool:
+        """
+        ユーザーの無効フラグを変更
+
+        Returns:
+            ユーザーが存在したか
+        """
+        pass
+
+    @abstractmethod
+    async def update_password_hash(self, username: str, old_hash: str, new_hash: str) -> bool:
+        """
+        パスワードのハッシュを置き換える（現在のハッシュがold_hashのときだけ）
+
+        Returns:
+            置き換えたか
+        """
+        pass
+
+    @abstractmethod
+    def usernames(self) -> AsyncIterator[str]:
+        """全ユーザー名を順に返す"""
+        pass
+
+    async def close(self) -> None:
+        """接続などを閉じる"""
+
+
+class InMemoryUserRepository(UserRepository):
+    """辞書に保存する実装（学習・テスト用）"""
+
+    def __init__(self, users: dict[str, dict] | None = None):
+        """
+        Args:
+            users: 初期データ（ユーザー名 -> ユーザー情報の辞書）
+        """
+        self._users = {username: UserInDB(**data) for username, data in (users or {}).items()}
+
+    async def get_by_username(self, username: str) -> UserInDB | None:
+        return self._users.get(username)
+
+    async def add(self, user: UserInDB) -> bool:
+        if user.username in self._users:
+            return False
+        self._users[user.username] = user
+        return True
+
+    async def set_disabled(self, username: str, disabled: bool = True) -> bool:
+        user = self._users.get(username)
+        if user is None:
+            return False
+        self._users[username] = user.model_copy(update={"disabled": disabled})
+        return True
+
+    async def update_password_hash(self, username: str, old_hash: str, new_hash: str) -> bool:
+        user = self._users.get(username)
+        if user is None or user.hashed_password != old_hash:
+            return False
+        self._users[username] = user.model_copy(update={"hashed_password": new_hash})
+        return True
+
+    async def usernames(self) -> AsyncIterator[str]:
+        for username in list(self._users):
+            yield username
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class UserRecord(Base):
+    """usersテーブル"""
+    __tablename__ = "users"
+
+    username: Mapped[str] = mapped_column(String(50), primary_key=True)
+    email: Mapped[str | None] = mapped_column(String(255))
+    full_name: Mapped[str | None] = mapped_column(String(100))
+    hashed_password: Mapped[str] = mapped_column(String(255))
+    disabled: Mapped[bool] = mapped_column(Boolean, default=False)
+
+
+class SqlAlchemyUserRepository(UserRepository):
+    """
+    SQLAlchemyの非同期エンジンに保存する実装
+
+    コネクションプールから接続を借りて使う（SQLiteでもAsyncAdaptedQueuePoolを使う）。
+    ユーザー名での検索文はバインドパラメーター付きで一度だけ組み立てておき、
+    SQLAlchemyのコンパイル済みキャッシュとドライバー側のプリペアドステートメントを再利用する。
+    """
+
+    _columns = [UserRecord.username, UserRecord.email, UserRecord.full_name,
+                UserRecord.hashed_password, UserRecord.disabled]
+
+    def __init__(self, url: str, pool_size: int = 10, max_overflow: int = 20):
+        """
+        Args:
+            url: 接続URL（例: "sqlite+aiosqlite:///./users.db", "postgresql+asyncpg://..."）
+            pool_size: プールに保持する接続数
+            max_overflow: 混雑時にpool_sizeを超えて作る接続数の上限
+        """
+        self.engine = create_async_engine(
+            url, poolclass=AsyncAdaptedQueuePool, pool_size=pool_size, max_overflow=max_overflow
+        )
+        self._by_username = select(*self._columns).where(
+            UserRecord.username == bindparam("username")
+        )
+
+    async def init(self) -> None:
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    async def get_by_username(self, username: str) -> UserInDB | None:
+        async with self.engine.connect() as conn:
+            row = (await conn.execute(self._by_username, {"username": username})).first()
+        return UserInDB(**row._mapping) if row is not None else None
+
+    async def add(self, user: UserInDB) -> bool:
+        try:
+            async with self.engine.begin() as conn:
+                await conn.execute(insert(UserRecord), [user.model_dump()])
+        except IntegrityError:
+            return False
+        return True
+
+    async def set_disabled(self, username: str, disabled: bool = True) -> bool:
+        async with self.engine.begin() as conn:
+            result = await conn.execute(
+                update(UserRecord).where(UserRecord.username == username).values(disabled=disabled)
+            )
+        return result.rowcount > 0
+
+    async def update_password_hash(self, username: str, old_hash: str, new_hash: str) -> bool:
+        async with self.engine.begin() as conn:
+            result = await conn.execute(
+                update(UserRecord)
+                .where(UserRecord.username == username, UserRecord.hashed_password == old_hash)
+                .values(hashed_password=new_hash)
+            )
+        return result.rowcount > 0
+
+    async def usernames(self) -> AsyncIterator[str]:
+        async with self.engine.connect() as conn:
+            async for row in await conn.stream(select(UserRecord.username)):
+                yield row.username
+
+    async def close(self) -> None:
+        await self.engine.dispose()
+
+
+# USER_DATABASE_URL を設定した場合はDBに、しなければメモリ上に保存する
+# 例: USER_DATABASE_URL=sqlite+aiosqlite:///./users.db
+user_repository: UserRepository = (
+    SqlAlchemyUserRepository(os.environ["USER_DATABASE_URL"])
+    if os.getenv("USER_DATABASE_URL") else InMemoryUserRepository(fake_users_db)
+)
+
+
+class BloomFilter:
+    """
+    存在するユーザー名のBloomフィルター
+
+    「含まれない」と判定した名前は確実に存在しないので、保存先に問い合わせずに断れる
+    （リスト型攻撃の大半は存在しないユーザー名なので、DBへの往復を省ける）。
+    「含まれる」は誤判定（偽陽性）の可能性があるため、その場合は保存先で確認する。
+    要素の削除はできない。ハッシュには起動ごとに変わる鍵を使い、
+    偽陽性になる名前を外部から狙って作れないようにしている。
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        """
+        Args:
+            capacity: 想定する要素数（超えると偽陽性率が上がる）
+            error_rate: capacity個のときの偽陽性率の目標
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+        self._key = os.urandom(16)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16, key=self._key).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        # ダブルハッシング: 2つのハッシュ値からhash_count個の位置を作る
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, item: str) -> None:
+        """要素を追加"""
+        bits = self._bits
+        for position in self._positions(item):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    @property
+    def false_positive_rate(self) -> float:
+        """現在の要素数での偽陽性率の推定値"""
+        return (1 - math.exp(-self.hash_count * self.count / self.size)) ** self.hash_count
+
+    @property
+    def memory_bytes(self) -> int:
+        """ビット配列のバイト数"""
+        return len(self._bits)
+
+    def stats(self) -> dict:
+        """要素数・偽陽性率の推定値・メモリ使用量"""
+        return {
+            "count": self.count,
+            "capacity": self.capacity,
+            "hash_count": self.hash_count,
+            "false_positive_rate": self.false_positive_rate,
+            "memory_bytes": self.memory_bytes,
+        }
+
+
+# 既知のユーザー名のフィルター（起動時とUSERNAME_FILTER_REFRESH_SECONDSごとに保存先から作り直す）
+# プロセスごとに持つため、複数ワーカーで動かすと他のワーカーで登録されたユーザーを次の作り直しまで
+# 「存在しない」と判定してしまう。そのため USERNAME_FILTER=1 のときだけ使う（既定は無効）
+USERNAME_FILTER_ENABLED = os.getenv("USERNAME_FILTER", "0") == "1"
+USERNAME_FILTER_REFRESH_SECONDS = float(os.getenv("USERNAME_FILTER_REFRESH_SECONDS", "60"))
+USERNAME_FILTER_CAPACITY = int(os.getenv("USERNAME_FILTER_CAPACITY", "100000"))
+username_filter = BloomFilter(USERNAME_FILTER_CAPACITY)
+for _username in fake_users_db:
+    username_filter.add(_username)
+
+
+# 作り直しの途中（usernames()を読んでいる間）に登録されたユーザー名。作り直しごとに1つ
+_usernames_added_during_rebuild: list[list[str]] = []
+
+
+def add_to_username_filter(username: str) -> None:
+    """登録したユーザー名をフィルターに追加（作り直し中なら作り直したフィルターにも入れる）"""
+    username_filter.add(username)
+    for added in _usernames_added_during_rebuild:
+        added.append(username)
+
+
+async def rebuild_username_filter() -> BloomFilter:
+    """保存先の全ユーザー名からフィルターを作り直す"""
+    global username_filter
+    # 読み出しの途中で登録されたユーザー名は読み出しに含まれないことがあるので、
+    # 記録しておいて入れ替える前に加える（入れ替えまでの間にawaitはない）
+    added: list[str] = []
+    _usernames_added_during_rebuild.append(added)
+    try:
+        usernames = [username async for username in user_repository.usernames()]
+    finally:
+        _usernames_added_during_rebuild.remove(added)
+    usernames += added
+    rebuilt = BloomFilter(max(USERNAME_FILTER_CAPACITY, len(usernames) * 2))
+    for username in usernames:
+        rebuilt.add(username)
+    username_filter = rebuilt
+    return rebuilt
+
+
+async def refresh_username_filter_periodically() -> None:
+    """USERNAME_FILTER_REFRESH_SECONDSごとにフィルターを作り直す（lifespanでタスクとして動かす）"""
+    while True:
+        await asyncio.sleep(USERNAME_FILTER_REFRESH_SECONDS)
+        try:
+            await rebuild_username_filter()
+        except Exception as exc:
+            # 保存先に一時的に繋がらなくても、今のフィルターのまま次の機会に作り直す
+            print(f"ユーザー名のフィルターを作り直せませんでした: {exc!r}")
+
+
+def username_may_exist(username: str) -> bool:
+    """保存先に問い合わせる必要があるか（フィルターが無効なときは常にTrue）"""
+    return not USERNAME_FILTER_ENABLED or username in username_filter
+
+
+class TokenCache:
+    """
+    検証済みのJWTのクレームとユーザーを、トークンの有効期限（exp）まで保持する
+
+    jwt.decode（HMACの計算・JSONの解析・クレームの検証）とUserInDBの生成を
+    同じトークンで毎回繰り返さないためのキャッシュ。
+    キーはトークンのSHA-256ダイジェストで、トークンそのものはメモリに残さない。
+    maxsizeを超えたら最後に使われたのが最も古いものから捨てる。
+    ユーザーを無効化したときはinvalidate_userでそのユーザーのエントリを全て消すこと。
+    無効化と並行して進んでいた検索の結果（無効化前のユーザー）を後から登録しないよう、
+    ユーザーごとに無効化の世代を数え、検索前に読んだ世代と変わっていればputしない。
+    イベントループのスレッドからだけ使う前提なのでロックは取らない。
+    """
+
+    def __init__(self, maxsize: int = 10_000):
+        """
+        Args:
+            maxsize: 保持するトークンの最大数（0ならキャッシュしない）
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[bytes, tuple[float, dict, UserInDB]] = OrderedDict()
+        self._keys_by_user: dict[str, set[bytes]] = {}
+        self._generations: dict[str, int] = {}  # ユーザー名 -> 無効化された回数
+        self._clears = 0  # clearした回数
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> tuple[dict, UserInDB] | None:
+        """
+        キャッシュ済みのクレームとユーザーを取得
+
+        Returns:
+            (クレーム, ユーザー)。未登録か期限切れならNone
+        """
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, claims, user = entry
+        if expires_at <= time.time():
+            self._discard(key, user.username)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return claims, user
+
+    def generation(self, username: str) -> int:
+        """ユーザーの無効化の世代（ユーザーを検索する前に読んでputに渡す）"""
+        # どちらも増えるだけなので、和はinvalidate_userでもclearでも必ず変わる
+        return self._clears + self._generations.get(username, 0)
+
+    def put(self, token: str, claims: dict, user: UserInDB, generation: int) -> None:
+        """
+        検証済みのトークンを登録（expのないトークンはキャッシュしない）
+
+        Args:
+            token: トークン
+            claims: デコードしたクレーム
+            user: 検索したユーザー
+            generation: 検索前に読んだgeneration(user.username)（その後で無効化されていれば登録しない）
+        """
+        expires_at = claims.get("exp")
+        if self.maxsize <= 0 or expires_at is None or self.generation(user.username) != generation:
+            return
+        key = self._key(token)
+        self._entries[key] = (expires_at, claims, user)
+        self._entries.move_to_end(key)
+        self._keys_by_user.setdefault(user.username, set()).add(key)
+        while len(self._entries) > self.maxsize:
+            old_key, (_, _, old_user) = self._entries.popitem(last=False)
+            self._discard(old_key, old_user.username)
+
+    def invalidate_user(self, username: str) -> int:
+        """
+        ユーザーのエントリを全て削除
+
+        Returns:
+            削除したエントリ数
+        """
+        self._generations[username] = self._generations.get(username, 0) + 1
+        keys = self._keys_by_user.pop(username, set())
+        for key in keys:
+            self._entries.pop(key, None)
+        return len(keys)
+
+    def clear(self) -> None:
+        """全て削除"""
+        self._clears += 1
+        self._entries.clear()
+        self._keys_by_user.clear()
+
+    def _discard(self, key: bytes, username: str) -> None:
+        self._entries.pop(key, None)
+        keys = self._keys_by_user.get(username)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[username]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+token_cache = TokenCache(maxsize=int(os.getenv("TOKEN_CACHE_SIZE", "10000")))
+
+
 # パスワード関連関数
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """プレーンテキストのパスワードとハッシュを比較"""
     return pwd_context.verify(plain_password, hashed_password)
 
 
-def get_password_hash(password: str) -> str:
-    """パスワードをハッシュ化"""
-    return pwd_context.hash(password)
+def get_password_hash(password: str, rounds: int | None = None) -> str:
+    """
+    パスワードをハッシュ化
+
+    Args:
+        password: パスワード
+        rounds: bcryptのコスト（省略時はbcrypt_rounds）
+    """
+    handler = pwd_context.handler("bcrypt")
+    return handler.using(rounds=rounds or bcrypt_rounds).hash(password)
+
+
+def get_bcrypt_rounds(hashed_password: str) -> int:
+    """ハッシュに記録されているbcryptのコストを取得"""
+    return pwd_context.handler("bcrypt").from_string(hashed_password).rounds
+
 
+def calibrate_bcrypt_rounds(target_ms: float, min_rounds: int = 10, max_rounds: int = 16) -> int:
+    """
+    このCPUで1回の検証がtarget_msを超えない最大のbcryptのコストを求める
+
+    bcryptはコストを1上げると時間が2倍になるので、min_roundsで計測した時間から外挿する
+
+    Args:
+        target_ms: 1回の検証にかけてよい時間（ミリ秒）
+        min_rounds: コストの下限
+        max_rounds: コストの上限
+
+    Returns:
+        bcryptのコスト
+    """
+    sample = get_password_hash("calibration", rounds=min_rounds)
+    elapsed = []
+    for _ in range(3):
+        started = time.perf_counter()
+        pwd_context.verify("calibration", sample)
+        elapsed.append(time.perf_counter() - started)
+    rounds = min_rounds + math.floor(math.log2(target_ms / 1000 / min(elapsed)))
+    return max(min_rounds, min(max_rounds, rounds))
+
+
+class PasswordHasherBusy(Exception):
+    """パスワードのハッシュ処理の待ち行列が一杯"""
+
+
+class PasswordHasher:
+    """
+    bcryptのハッシュ化・検証をプロセスプールで実行する
+
+    bcrypt（コスト12）は1回で約250msCPUを使うため、async def の中で直接呼ぶと
+    その間イベントループが止まり、他のリクエストも全て待たされる。
+    プロセスプールに任せることでイベントループは他のリクエストを処理し続けられる。
+
+    実行中と待機中の件数はmax_pendingまでに制限する（バックプレッシャー）。
+    一杯のときは待ち行列を伸ばさずにPasswordHasherBusyを送出し、503ですぐに断る。
+
+    ワーカーはforkserverで起動する（aiosqliteやサンプラーのスレッドがある親プロセスをforkしない）。
+    ワーカーが異常終了して壊れたプールは、次の投入時に作り直す。
+    """
+
+    def __init__(self, max_workers: int, max_pending: int | None = None):
+        """
+        Args:
+            max_workers: ワーカープロセス数（0ならイベントループ上でそのまま実行する）
+            max_pending: 同時に受け付ける件数の上限（省略時はmax_workersの4倍）
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending if max_pending is not None else max(max_workers, 1) * 4
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._executor: ProcessPoolExecutor | None = None
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """verify_passwordをプールで実行"""
+        with trace_span("bcrypt verify"):
+            return await self._run(verify_password, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        """get_password_hashをプールで実行"""
+        with trace_span("bcrypt hash"):
+            # ワーカーは起動時に計測したコストを知らないので明示的に渡す
+            return await self._run(get_password_hash, password, bcrypt_rounds)
+
+    async def _run(self, func, *args):
+        if self.max_workers == 0:
+            return func(*args)
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise PasswordHasherBusy()
+            self.pending += 1
+        try:
+            future = self._submit(func, *args)
+        except BaseException:
+            self._release(None)
+            raise
+        # 件数はプール側の処理が終わった時点で戻す
+        # （クライアントが切断してawaitがキャンセルされても、処理中の分は数え続ける）
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
 
-def get_user(db: dict, username: str) -> UserInDB | None:
+    def _submit(self, func, *args) -> Future:
+        executor = self._get_executor()
+        try:
+            return executor.submit(func, *args)
+        except BrokenProcessPool:
+            # ワーカーが異常終了したプールには二度と投入できないので、作り直して1回だけやり直す
+            self._discard_executor(executor)
+            return self._get_executor().submit(func, *args)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("forkserver"),
+                )
+            return self._executor
+
+    def _discard_executor(self, executor: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self, _future) -> None:
+        with self._lock:
+            self.pending -= 1
+
+    def shutdown(self) -> None:
+        """プロセスプールを止める"""
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+# PASSWORD_HASH_WORKERS=0 で従来どおりイベントループ上でbcryptを実行する
+password_hasher = PasswordHasher(
+    max_workers=int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+)
+
+
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    """ハッシュ処理が混雑しているときは少し待ってから再試行してもらう"""
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Too many concurrent password operations"},
+        headers={"Retry-After": "1"},
+    )
+
+
+async def get_user(repository: UserRepository, username: str) -> UserInDB | None:
     """データベースからユーザーを取得"""
-    if username in db:
-        user_dict = db[username]
-        return UserInDB(**user_dict)
-    return None
+    with trace_span("user lookup"):
+        return await repository.get_by_username(username)
 
 
-def authenticate_user(fake_db: dict, username: str, password: str) -> UserInDB | bool:
+async def authenticate_user(repository: UserRepository, username: str, password: str) -> UserInDB | bool:
     """ユーザーを認証"""
-    user = get_user(fake_db, username)
+    # 確実に存在しないユーザー名は保存先に問い合わせずに断る
+    if not username_may_exist(username):
+        return False
+    user = await get_user(repository, username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await password_hasher.verify(password, user.hashed_password):
         return False
     return user
 
 
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class TokenService:
+    """
+    HS256のJWTを発行・検証する
+
+    joseのjwt.encode/decodeは呼び出しごとにHMACの鍵の準備とヘッダーのJSON化をやり直す。
+    ここでは鍵ごとにエンコード済みのヘッダーと鍵をセットしたHMACオブジェクトを作っておき、
+    署名のたびにそれをcopy()して使う。JSONは区切りの空白を省いた形にする。
+
+    鍵はkid（鍵ID）ごとのキーリングで持つ。発行にはactive_kidの鍵を使い、ヘッダーに
+    kidを入れる。検証はkidで鍵を選ぶので、rotateで新しい鍵に切り替えた後も、古い鍵で
+    発行されたトークンは期限まで使える（不要になった鍵はretireで外す）。
+    kidのないトークン（joseで発行したものなど）はlegacy_kidの鍵で検証する。
+    """
+
+    def __init__(self, keys: dict[str, str | bytes], active_kid: str, legacy_kid: str | None = None):
+        """
+        Args:
+            keys: kid -> 鍵
+            active_kid: 発行に使う鍵のkid
+            legacy_kid: kidのないトークンの検証に使う鍵のkid
+        """
+        self._macs: dict[str, hmac.HMAC] = {}
+        self._headers: dict[str, str] = {}
+        # エンコード済みのヘッダー -> 検証に使うHMAC（既知のヘッダーはJSONを解析しない）
+        self._verifiers: dict[str, hmac.HMAC] = {}
+        self.legacy_kid = legacy_kid
+        for kid, key in keys.items():
+            self.add_key(kid, key)
+        self.active_kid = active_kid
+        for kid in (active_kid, legacy_kid):
+            if kid is not None and kid not in self._macs:
+                raise ValueError(f"Unknown kid: {kid}")
+
+    def add_key(self, kid: str, key: str | bytes) -> None:
+        """検証用の鍵を追加"""
+        if isinstance(key, str):
+            key = key.encode()
+        mac = hmac.new(key, digestmod=hashlib.sha256)
+        header = _b64encode(json.dumps({"alg": "HS256", "typ": "JWT", "kid": kid},
+                                       separators=(",", ":")).encode())
+        self._macs[kid] = mac
+        self._headers[kid] = header
+        self._verifiers[header] = mac
+
+    def rotate(self, kid: str, key: str | bytes) -> None:
+        """新しい鍵を追加して、以降の発行に使う"""
+        self.add_key(kid, key)
+        self.active_kid = kid
+
+    def retire(self, kid: str) -> None:
+        """
+        鍵を外す（その鍵で発行したトークンは検証できなくなる）
+
+        TokenCacheに登録済みのトークンは検証を通らずに受け付けられるので、
+        アプリではキャッシュも空にするretire_signing_keyを使うこと。
+        """
+        if kid == self.active_kid:
+            raise ValueError("Cannot retire the active key")
+        del self._macs[kid]
+        self._verifiers.pop(self._headers.pop(kid), None)
+
+    def encode(self, claims: dict) -> str:
+        """
+        クレームに署名してトークンを作る
+
+        Args:
+            claims: クレーム（datetimeの値はUNIX時刻に変換する）
+
+        Returns:
+            JWT
+        """
+        claims = {
+            name: int(value.timestamp()) if isinstance(value, datetime) else value
+            for name, value in claims.items()
+        }
+        payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+        signing_input = f"{self._headers[self.active_kid]}.{payload}"
+        mac = self._macs[self.active_kid].copy()
+        mac.update(signing_input.encode("ascii"))
+        return f"{signing_input}.{_b64encode(mac.digest())}"
+
+    def decode(self, token: str) -> dict:
+        """
+        署名と有効期限を検証してクレームを返す
+
+        Raises:
+            JWTError: 形式・署名が不正な場合（期限切れはExpiredSignatureError）
+        """
+        try:
+            header, payload, signature = token.split(".")
+            mac = self._verifiers.get(header) or self._verifier_for(header)
+            mac = mac.copy()
+            mac.update(f"{header}.{payload}".encode("ascii"))
+            if not hmac.compare_digest(mac.digest(), _b64decode(signature)):
+                raise JWTError("Signature verification failed")
+            claims = json.loads(_b64decode(payload))
+            if not isinstance(claims, dict):
+                raise JWTError("Invalid payload")
+            now = time.time()
+            if "exp" in claims and claims["exp"] <= now:
+                raise ExpiredSignatureError("Signature has expired")
+            if "nbf" in claims and claims["nbf"] > now:
+                raise JWTClaimsError("The token is not yet valid")
+        except (ValueError, UnicodeError, KeyError, TypeError) as e:
+            raise JWTError("Invalid token") from e
+        return claims
+
+    def _verifier_for(self, header: str) -> hmac.HMAC:
+        """初めて見るヘッダー（kidなし、別の並びなど）を解析して鍵を選ぶ"""
+        fields = json.loads(_b64decode(header))
+        if not isinstance(fields, dict):
+            raise JWTError("Invalid header string: must be a json object")
+        if fields.get("alg") != "HS256":
+            raise JWTError("Unsupported algorithm")
+        return self._macs[fields.get("kid", self.legacy_kid)]
+
+
+def _create_token_service() -> TokenService:
+    if not JWT_KEYS:
+        return TokenService({"default": SECRET_KEY}, active_kid="default", legacy_kid="default")
+    keys = dict(item.split(":", 1) for item in JWT_KEYS.split(","))
+    return TokenService(keys, active_kid=list(keys)[-1], legacy_kid=JWT_LEGACY_KID or list(keys)[0])
+
+
+token_service = _create_token_service()
+
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None) -> str:
     """
     JWTアクセストークンを生成
@@ -124,8 +910,7 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None) -> s
         expire = datetime.now(timezone.utc) + timedelta(minutes=15)
 
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    return token_service.encode(to_encode)
 
 
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
@@ -135,8 +920,13 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached[1]
+
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with trace_span("JWT decode"):
+            payload = token_service.decode(token)
         username: str | None = payload.get("sub")
         if username is None:
             raise credentials_exception
@@ -144,9 +934,11 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     except JWTError:
         raise credentials_exception
 
-    user = get_user(fake_users_db, username=token_data.username)
+    generation = token_cache.generation(token_data.username)
+    user = await get_user(user_repository, username=token_data.username)
     if user is None:
         raise credentials_exception
+    token_cache.put(token, payload, user, generation)
     return user
 
 
@@ -157,17 +949,245 @@ async def get_current_active_user(current_user: User = Depends(get_current_user)
     return current_user
 
 
+# 管理者のユーザー名（カンマ区切り）。/debug 以下のエンドポイントは管理者だけが使える
+ADMIN_USERNAMES = {name for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name}
+
+
+async def get_current_admin_user(current_user: User = Depends(get_current_active_user)) -> User:
+    """管理者のみを許可"""
+    if current_user.username not in ADMIN_USERNAMES:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    return current_user
+
+
+if tracer is not None:
+    @app.get("/debug/trace.json", dependencies=[Depends(get_current_admin_user)])
+    async def export_chrome_trace():
+        """記録したトレースをChrome trace event形式で返す（chrome://tracing で表示）"""
+        return tracer.chrome_trace()
+
+    @app.get("/debug/trace.folded", response_class=PlainTextResponse,
+             dependencies=[Depends(get_current_admin_user)])
+    async def export_folded_stacks():
+        """記録したトレースをflame graph用のfolded stack形式で返す"""
+        return tracer.folded_stacks()
+
+
+# CPUプロファイリング（PROFILE_SAMPLE_RATE を設定したときだけ有効）
+# 第2章 問題1のプロファイラーで、一部のリクエストの処理中のスタックを採取する
+# 管理用エンドポイントは管理者だけが使え、X-Debug-Profile ヘッダーの値が
+# PROFILE_DEBUG_TOKEN と一致するリクエストは必ずプロファイルする
+if os.getenv("PROFILE_SAMPLE_RATE") is not None:
+    profiler = _load_solution("02-fastapi-intro", "solution_01.py").install_profiler(
+        app,
+        dependencies=[Depends(get_current_admin_user)],
+        sample_rate=float(os.environ["PROFILE_SAMPLE_RATE"]),
+        debug_token=os.getenv("PROFILE_DEBUG_TOKEN"),
+        admin_path="/debug/profile",
+    )
+
+
+async def disable_user(username: str) -> None:
+    """ユーザーを無効化し、キャッシュ済みのトークンを破棄する"""
+    await user_repository.set_disabled(username)
+    token_cache.invalidate_user(username)
+
+
+def retire_signing_key(kid: str) -> None:
+    """署名鍵を外し、その鍵で発行されたものを含むキャッシュ済みのトークンを破棄する"""
+    token_service.retire(kid)
+    token_cache.clear()
+
+
+# ログインのレート制限
+class RateLimiter:
+    """
+    GCRA（Generic Cell Rate Algorithm）によるキーごとのレート制限
+
+    トークンバケットと同じ判定になるが、キーごとに「理論上の次の到着時刻」（TAT）を
+    1つ持つだけで済み、判定はO(1)。
+    TATが現在時刻を過ぎたキーはバケットが満タンの状態と同じなので、削除しても
+    判定は変わらない。そうしたアイドルなキーを古い順に追い出してメモリを抑え、
+    それでもmax_keysを超える場合は最後に使われたのが最も古いキーから捨てる。
+    イベントループのスレッドからだけ使う前提なのでロックは取らない。
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 100_000):
+        """
+        Args:
+            rate: 1秒あたりに許可する回数（math.infなら制限しない）
+            burst: 連続で許可する回数の上限
+            max_keys: 保持するキーの最大数
+        """
+        self.interval = 1.0 / rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._tats: OrderedDict[str, float] = OrderedDict()
+
+    def hit(self, key: str, now: float | None = None) -> float:
+        """
+        1回分のリクエストを記録
+
+        Args:
+            key: 制限の単位（クライアントIPやユーザー名）
+            now: 現在時刻（省略時はtime.monotonic()）
+
+        Returns:
+            許可なら0.0、拒否なら再試行できるまでの秒数
+        """
+        if now is None:
+            now = time.monotonic()
+        tats = self._tats
+        new_tat = max(tats.get(key, now), now) + self.interval
+        allowed_at = new_tat - self.burst * self.interval
+        if allowed_at > now:
+            return allowed_at - now
+        tats[key] = new_tat
+        tats.move_to_end(key)
+        # 先頭（最後に使われたのが最も古いキー）から、アイドルなものと上限を超えた分を捨てる
+        while tats:
+            oldest_key = next(iter(tats))
+            if tats[oldest_key] > now and len(tats) <= self.max_keys:
+                break
+            del tats[oldest_key]
+        return 0.0
+
+    def __len__(self) -> int:
+        return len(self._tats)
+
+
+# クライアントIPごと・ユーザー名ごとの制限（1分あたりの回数、連続で許可する回数）
+LOGIN_RATE_PER_IP = (20 / 60, 10)
+LOGIN_RATE_PER_USERNAME = (5 / 60, 5)
+ip_rate_limiter = RateLimiter(*LOGIN_RATE_PER_IP)
+username_rate_limiter = RateLimiter(*LOGIN_RATE_PER_USERNAME)
+
+
+class LoginRateLimitMiddleware:
+    """
+    /token と /register をクライアントIPとユーザー名ごとにレート制限するASGIミドルウェア
+
+    bcryptが重いため、これらを無制限に受け付けるとCPUを簡単に使い切られてしまう。
+    ユーザー名は /token ではフォームの本文、/register ではクエリパラメーターから取り、
+    読んだ本文はエンドポイントにそのまま渡し直す。
+    制限を超えたリクエストは429とRetry-Afterで断る。
+    ユーザー名を読めない形のリクエストは、ユーザー名ごとの制限を避けられてしまうので通さない。
+    /token はurlencodedのフォーム以外（multipartなど）を415で断り（OAuth2の仕様もurlencoded）、
+    大きすぎる本文は413、ユーザー名が複数ある（エンドポイントは最後の値を使う）場合は400で断る。
+    （プロキシの背後ではscope["client"]がプロキシのIPになるので、信頼できる
+    X-Forwarded-Forから実際のIPを取るように変えること）
+    """
+
+    paths = {"/token", "/register"}
+    max_body = 8192
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        client = scope.get("client")
+        retry_after = ip_rate_limiter.hit(client[0] if client else "unknown")
+
+        if not retry_after:
+            username, receive, error = await self._read_username(scope, receive)
+            if error is not None:
+                status_code, detail = error
+                await JSONResponse(status_code=status_code, content={"detail": detail})(scope, receive, send)
+                return
+            if username is not None:
+                retry_after = username_rate_limiter.hit(username)
+
+        if retry_after:
+            response = JSONResponse(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                content={"detail": "Too many requests"},
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+    async def _read_username(self, scope, receive):
+        """
+        リクエストのユーザー名を読む
+
+        Returns:
+            (ユーザー名, 読んだ本文を渡し直すreceive, 断る場合の(ステータスコード, 詳細)またはNone)
+        """
+        if scope["path"] == "/register":
+            query = parse_qs(scope["query_string"].decode("latin-1"))
+            return self._single_username(query.get("username", []), receive)
+
+        content_type = Headers(scope=scope).get("content-type", "")
+        if content_type.split(";")[0].strip().lower() != "application/x-www-form-urlencoded":
+            return None, receive, (status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                                   "Content-Type must be application/x-www-form-urlencoded")
+
+        messages = []
+        body = b""
+        while len(body) <= self.max_body:
+            message = await receive()
+            messages.append(message)
+            body += message.get("body", b"")
+            if not message.get("more_body", False):
+                break
+
+        async def replay():
+            return messages.pop(0) if messages else await receive()
+
+        if len(body) > self.max_body:
+            return None, replay, (status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, "Request body too large")
+        try:
+            form = parse_qs(body.decode())
+        except UnicodeDecodeError:
+            return None, replay, (status.HTTP_400_BAD_REQUEST, "Invalid form body")
+        return self._single_username(form.get("username", []), replay)
+
+    @staticmethod
+    def _single_username(usernames: list[str], receive):
+        # ユーザー名がなければエンドポイントが422で断る（bcryptは走らない）
+        if len(usernames) > 1:
+            return None, receive, (status.HTTP_400_BAD_REQUEST, "Duplicate username")
+        return (usernames[0] if usernames else None), receive, None
+
+
+app.add_middleware(LoginRateLimitMiddleware)
+
+
+async def rehash_password(user: UserInDB, password: str) -> None:
+    """
+    保存されているハッシュのコストが現在の設定と違えば、現在のコストでハッシュし直す
+
+    ログイン成功時にレスポンスを返した後で実行する（平文のパスワードが分かるのはこの時だけ）
+    """
+    if get_bcrypt_rounds(user.hashed_password) == bcrypt_rounds:
+        return
+    try:
+        new_hash = await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        # 混雑時は見送り、次回のログインでやり直す
+        return
+    await user_repository.update_password_hash(user.username, user.hashed_password, new_hash)
+
+
 # エンドポイント
 @app.post("/token", response_model=Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
+async def login_for_access_token(
+    background_tasks: BackgroundTasks, form_data: OAuth2PasswordRequestForm = Depends()
+):
     """ログインしてアクセストークンを取得"""
-    user = authenticate_user(fake_users_db, form_data.username, form_data.password)
+    user = await authenticate_user(user_repository, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    background_tasks.add_task(rehash_password, user, form_data.password)
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user.username}, expires_delta=access_token_expires
@@ -191,21 +1211,355 @@ async def read_own_items(current_user: User = Depends(get_current_active_user)):
 @app.post("/register")
 async def register_user(username: str, password: str, email: str, full_name: str):
     """新しいユーザーを登録（テスト用）"""
-    if username in fake_users_db:
-        raise HTTPException(status_code=400, detail="Username already registered")
-
-    hashed_password = get_password_hash(password)
-    fake_users_db[username] = {
-        "username": username,
-        "full_name": full_name,
-        "email": email,
-        "hashed_password": hashed_password,
-        "disabled": False,
-    }
+    already_registered = HTTPException(status_code=400, detail="Username already registered")
+    # フィルターに含まれない名前は未登録と分かるので、事前の確認を省く
+    if username_may_exist(username) and await user_repository.get_by_username(username) is not None:
+        raise already_registered
+
+    hashed_password = await password_hasher.hash(password)
+    user = UserInDB(
+        username=username,
+        full_name=full_name,
+        email=email,
+        hashed_password=hashed_password,
+        disabled=False,
+    )
+    # ハッシュ化の間に同じユーザー名が登録された場合もここで弾く
+    if not await user_repository.add(user):
+        raise already_registered
+    add_to_username_filter(username)
     return {"message": "User created successfully"}
 
 
-if __name__ == "__main__":
+def _percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+async def benchmark_login_load(logins: int = 24, concurrency: int = 8):
+    """
+    ログイン中の/tokenのスループットと、無関係なエンドポイント（/users/me）のp99を計測
+
+    bcryptをイベントループ上で実行する場合（PASSWORD_HASH_WORKERS=0相当）と
+    プロセスプールで実行する場合を比較する
+
+    Args:
+        logins: /tokenへのリクエスト数
+        concurrency: 同時に送るログインの数
+    """
+    import httpx
+
+    global password_hasher, ip_rate_limiter, username_rate_limiter
+    original = password_hasher, ip_rate_limiter, username_rate_limiter
+    # 同じユーザーで何度もログインするのでレート制限は外す
+    ip_rate_limiter = username_rate_limiter = RateLimiter(math.inf, 1)
+    form = {"username": "johndoe", "password": "secret"}
+    print(f"\n=== ログイン負荷テスト（{logins}件、同時{concurrency}件、CPU {os.cpu_count()}個） ===")
+    for label, hasher in [("イベントループ上", PasswordHasher(max_workers=0)),
+                          ("プロセスプール", PasswordHasher(max_workers=os.cpu_count() or 1,
+                                                          max_pending=logins))]:
+        password_hasher = hasher
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            token = (await client.post("/token", data=form)).json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+            slots = asyncio.Semaphore(concurrency)
+            done = False
+            probe_latencies: list[float] = []
+
+            async def login():
+                async with slots:
+                    return (await client.post("/token", data=form)).status_code
+
+            async def probe(interval: float = 0.01):
+                # 一定間隔で送る予定の時刻から計測する（イベントループが止まって
+                # 送れなかった時間も遅延に含める）
+                scheduled = time.perf_counter()
+                while not done:
+                    await client.get("/users/me", headers=headers)
+                    probe_latencies.append(time.perf_counter() - scheduled)
+                    # 遅れた分の予定は飛ばす
+                    scheduled = max(scheduled + interval, time.perf_counter())
+                    await asyncio.sleep(scheduled - time.perf_counter())
+
+            probe_task = asyncio.create_task(probe())
+            started = time.perf_counter()
+            codes = await asyncio.gather(*(login() for _ in range(logins)))
+            elapsed = time.perf_counter() - started
+            done = True
+            await probe_task
+        hasher.shutdown()
+        print(f"{label}: /token {codes.count(200) / elapsed:.1f} req/s"
+              f"（503: {codes.count(503)}件）, "
+              f"/users/me p99 {_percentile(probe_latencies, 99) * 1000:.1f}ms"
+              f"（{len(probe_latencies)}件）")
+    password_hasher, ip_rate_limiter, username_rate_limiter = original
+
+
+async def benchmark_users_me(requests: int = 2000):
+    """
+    /users/me の1リクエストあたりの時間をTokenCacheの有無で比較
+
+    Args:
+        requests: リクエスト数
+    """
+    import httpx
+
+    global token_cache
+    original = token_cache
+    print(f"\n=== /users/me（{requests}件） ===")
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        form = {"username": "johndoe", "password": "secret"}
+        token = (await client.post("/token", data=form)).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        for label, cache in [("キャッシュなし", TokenCache(maxsize=0)), ("キャッシュあり", TokenCache())]:
+            token_cache = cache
+            started = time.perf_counter()
+            for _ in range(requests):
+                await client.get("/users/me", headers=headers)
+            per_request = (time.perf_counter() - started) / requests
+
+            started = time.perf_counter()
+            for _ in range(requests):
+                await get_current_user(token)
+            per_call = (time.perf_counter() - started) / requests
+            print(f"{label}: /users/me {per_request * 1e6:.0f}µs/件, "
+                  f"get_current_user {per_call * 1e6:.1f}µs/回")
+    token_cache = original
+
+
+async def benchmark_concurrent_users_me(concurrency: int = 2000):
+    """
+    同時に大量の /users/me を送り、保存先ごとのスループットとp99を計測
+
+    TokenCacheを無効にして、毎回ユーザーの保存先を参照させる
+
+    Args:
+        concurrency: 同時に送るリクエスト数
+    """
+    import httpx
+
+    global user_repository, token_cache
+    original_repository, original_cache = user_repository, token_cache
+    token_cache = TokenCache(maxsize=0)
+    token = create_access_token({"sub": "johndoe"}, timedelta(minutes=5))
+    headers = {"Authorization": f"Bearer {token}"}
+    print(f"\n=== /users/me 同時{concurrency}件 ===")
+    with tempfile.TemporaryDirectory() as directory:
+        repositories = [
+            ("メモリ", InMemoryUserRepository()),
+            ("SQLite（aiosqlite, プール10+20）",
+             SqlAlchemyUserRepository(f"sqlite+aiosqlite:///{directory}/users.db")),
+        ]
+        for label, repository in repositories:
+            user_repository = repository
+            await repository.init()
+            for user_dict in fake_users_db.values():
+                await repository.add(UserInDB(**user_dict))
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                # 全リクエストを同時に送った時刻から、それぞれの応答までの時間を計る
+                async def call():
+                    response = await client.get("/users/me", headers=headers)
+                    return response.status_code, time.perf_counter() - started
+
+                started = time.perf_counter()
+                results = await asyncio.gather(*(call() for _ in range(concurrency)))
+                elapsed = time.perf_counter() - started
+            await repository.close()
+            ok = sum(1 for code, _ in results if code == 200)
+            print(f"{label}: {concurrency / elapsed:.0f} req/s（成功 {ok}/{concurrency}）, "
+                  f"p99 {_percentile([latency for _, latency in results], 99) * 1000:.0f}ms")
+    user_repository, token_cache = original_repository, original_cache
+
+
+def benchmark_username_filter(users: int = 100_000, probes: int = 100_000):
+    """
+    ユーザー名のBloomフィルターの偽陽性率・メモリ・判定時間を計測
+
+    Args:
+        users: 登録するユーザー名の数
+        probes: 判定する未登録のユーザー名の数
+    """
+    print(f"\n=== ユーザー名のBloomフィルター（{users}件） ===")
+    bloom = BloomFilter(users)
+    for i in range(users):
+        bloom.add(f"user{i}")
+    started = time.perf_counter()
+    false_positives = sum(1 for i in range(probes) if f"unknown{i}" in bloom)
+    per_check = (time.perf_counter() - started) / probes
+    assert all(f"user{i}" in bloom for i in range(0, users, 97))
+    stats = bloom.stats()
+    print(f"偽陽性率: 実測 {false_positives / probes:.4f} / 推定 {stats['false_positive_rate']:.4f}"
+          f"（ハッシュ{stats['hash_count']}個）")
+    print(f"メモリ: {stats['memory_bytes'] / 1024:.0f}KB"
+          f"（set[str]なら約{sys.getsizeof(set(map(str, range(users)))) / 1024:.0f}KB + 文字列）")
+    print(f"判定: {per_check * 1e6:.2f}µs/回")
+
+
+async def benchmark_rate_limiter(hits: int = 1_000_000, keys: int = 100_000):
+    """
+    RateLimiterの1回あたりの判定時間と、ミドルウェアによる1リクエストあたりの上乗せ分を計測
+
+    Args:
+        hits: 判定の回数
+        keys: キー（クライアント）の数
+    """
+    print(f"\n=== レート制限（{keys}キー、{hits}回） ===")
+    limiter = RateLimiter(rate=1.0, burst=5, max_keys=keys // 2)
+    names = [f"10.0.{i >> 8 & 255}.{i & 255}-{i}" for i in range(keys)]
+    started = time.perf_counter()
+    for i in range(hits):
+        limiter.hit(names[i % keys])
+    per_hit = (time.perf_counter() - started) / hits
+    print(f"RateLimiter.hit: {per_hit * 1e6:.2f}µs/回, 保持キー数 {len(limiter)}（上限 {keys // 2}）")
+
+    # 本文を読んで200を返すだけのアプリの前に置いたときの差を見る
+    async def endpoint(scope, receive, send):
+        await receive()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def receive():
+        return {"type": "http.request", "body": b"username=johndoe&password=secret", "more_body": False}
+
+    async def send(message):
+        pass
+
+    global ip_rate_limiter, username_rate_limiter
+    original = ip_rate_limiter, username_rate_limiter
+    ip_rate_limiter = username_rate_limiter = RateLimiter(math.inf, 1)
+    scope = {"type": "http", "path": "/token", "client": ("127.0.0.1", 50000), "query_string": b""}
+    requests = 100_000
+    for label, asgi_app in [("ミドルウェアなし", endpoint), ("ミドルウェアあり", LoginRateLimitMiddleware(endpoint))]:
+        started = time.perf_counter()
+        for _ in range(requests):
+            await asgi_app(scope, receive, send)
+        print(f"{label}: {(time.perf_counter() - started) / requests * 1e6:.2f}µs/件")
+    ip_rate_limiter, username_rate_limiter = original
+
+
+def benchmark_bcrypt_cost(target_ms: float = 250):
+    """
+    bcryptのコストごとの検証時間と、target_msに合わせて選ばれるコストを表示
+
+    Args:
+        target_ms: 1回の検証の目標時間（ミリ秒）
+    """
+    print("\n=== bcryptのコスト ===")
+    for rounds in range(10, 14):
+        sample = get_password_hash("benchmark", rounds=rounds)
+        started = time.perf_counter()
+        pwd_context.verify("benchmark", sample)
+        print(f"コスト{rounds}: {(time.perf_counter() - started) * 1000:.0f}ms")
+    print(f"目標{target_ms:.0f}msでの設定: コスト{calibrate_bcrypt_rounds(target_ms)}")
+
+
+def benchmark_token_service(iterations: int = 20_000):
+    """
+    JWTの発行・検証をjoseとTokenServiceで比較
+
+    Args:
+        iterations: 繰り返し回数
+    """
+    print(f"\n=== JWTの発行・検証（{iterations}回） ===")
+    service = TokenService({"default": SECRET_KEY}, active_kid="default", legacy_kid="default")
+    claims = {"sub": "johndoe", "exp": datetime.now(timezone.utc) + timedelta(minutes=30)}
+    jose_token = jwt.encode(claims, SECRET_KEY, algorithm=ALGORITHM)
+    service_token = service.encode(claims)
+    cases = [
+        ("jose 発行", lambda: jwt.encode(claims, SECRET_KEY, algorithm=ALGORITHM)),
+        ("TokenService 発行", lambda: service.encode(claims)),
+        ("jose 検証", lambda: jwt.decode(jose_token, SECRET_KEY, algorithms=[ALGORITHM])),
+        ("TokenService 検証", lambda: service.decode(service_token)),
+    ]
+    for label, func in cases:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        elapsed = time.perf_counter() - started
+        print(f"{label}: {iterations / elapsed:,.0f}回/秒（{elapsed / iterations * 1e6:.1f}µs/回）")
+
+
+if __name__ == "__main__" and "--bench" in sys.argv:
+    benchmark_token_service()
+    benchmark_bcrypt_cost()
+    asyncio.run(benchmark_rate_limiter())
+    benchmark_username_filter()
+    asyncio.run(benchmark_login_load())
+    asyncio.run(benchmark_users_me())
+    asyncio.run(benchmark_concurrent_users_me())
+elif __name__ == "__main__" and "--test" in sys.argv:
+    # TokenService（joseの代わりの署名・検証）のテスト
+    expires = datetime.now(timezone.utc) + timedelta(minutes=5)
+    service = TokenService({"k1": "secret-a"}, active_kid="k1", legacy_kid="k1")
+
+    def assert_rejected(token: str, error: type[JWTError] = JWTError) -> None:
+        try:
+            service.decode(token)
+        except error:
+            return
+        raise AssertionError(f"受け付けてしまいました: {token}")
+
+    token = service.encode({"sub": "alice", "exp": expires})
+    assert service.decode(token)["sub"] == "alice"
+    assert jwt.decode(token, "secret-a", algorithms=["HS256"])["sub"] == "alice"  # joseでも検証できる
+    assert jwt.get_unverified_header(token)["kid"] == "k1"
+
+    # 改ざんされた署名・ペイロード、形式の不正なトークン
+    header, payload, signature = token.split(".")
+    assert_rejected(f"{header}.{payload}.{signature[:-2]}AA")
+    forged = _b64encode(b'{"sub":"admin"}')
+    assert_rejected(f"{header}.{forged}.{signature}")
+    for malformed in ["", "abc", "a.b", "x.y.z", f"{header}.{payload}"]:
+        assert_rejected(malformed)
+
+    # 期限切れ・有効期間の前
+    assert_rejected(service.encode({"sub": "alice", "exp": int(time.time()) - 1}), ExpiredSignatureError)
+    assert_rejected(service.encode({"sub": "alice", "exp": expires, "nbf": expires}), JWTClaimsError)
+
+    # HS256以外のalg（alg=noneを含む）
+    assert_rejected(jwt.encode({"sub": "alice"}, "secret-a", algorithm="HS512"))
+    none_header = _b64encode(b'{"alg":"none","typ":"JWT"}')
+    assert_rejected(f"{none_header}.{payload}.")
+
+    # オブジェクトでないヘッダー・ペイロード
+    for value in [b"[]", b'"x"', b"1", b"null"]:
+        assert_rejected(f"{_b64encode(value)}.{payload}.{signature}")
+        unsigned = f"{header}.{_b64encode(value)}"
+        mac = hmac.new(b"secret-a", unsigned.encode(), hashlib.sha256)
+        assert_rejected(f"{unsigned}.{_b64encode(mac.digest())}")
+
+    # joseで発行したkidのないトークンはlegacy_kidの鍵で検証する
+    legacy = jwt.encode({"sub": "bob", "exp": expires}, "secret-a", algorithm="HS256")
+    assert service.decode(legacy)["sub"] == "bob"
+    assert_rejected(jwt.encode({"sub": "bob", "exp": expires}, "other", algorithm="HS256"))
+
+    # rotate後も古い鍵のトークンは期限まで使え、retireすると使えなくなる
+    service.rotate("k2", "secret-b")
+    rotated = service.encode({"sub": "carol", "exp": expires})
+    assert jwt.get_unverified_header(rotated)["kid"] == "k2"
+    assert service.decode(token)["sub"] == "alice" and service.decode(rotated)["sub"] == "carol"
+    try:
+        service.retire("k2")
+        raise AssertionError("使用中の鍵を外せてしまいました")
+    except ValueError:
+        pass
+    service.retire("k1")
+    assert_rejected(token)
+    assert_rejected(legacy)
+    assert service.decode(rotated)["sub"] == "carol"
+
+    # JWT_KEYSを設定した場合も、kidのないトークンは既定で最初の鍵で検証する
+    JWT_KEYS = "old:secret-a,new:secret-b"
+    service = _create_token_service()
+    assert service.legacy_kid == "old" and service.decode(legacy)["sub"] == "bob"
+    JWT_LEGACY_KID = "new"
+    assert _create_token_service().legacy_kid == "new"
+
+    print("\n全てのテストが成功しました！")
+elif __name__ == "__main__":
     import uvicorn
 
     print("\n=== FastAPI 認証システムのデモ ===")
@@ -225,6 +1579,22 @@ if __name__ == "__main__":
     print("\nデフォルトユーザー:")
     print("  username: johndoe, password: secret")
     print("  username: alice, password: secret")
+    print("\nリクエストのトレース（TRACE_REQUESTS=1 で起動した場合、ADMIN_USERNAMES の管理者のみ）:")
+    print("   GET /debug/trace.json    (Chrome trace event形式)")
+    print("   GET /debug/trace.folded  (flame graph用のfolded stack形式)")
+    print("\nbcryptのコスト: BCRYPT_ROUNDS=12（既定）または BCRYPT_TARGET_MS=250 で起動時に計測して決定")
+    print("   保存済みのハッシュのコストが違う場合、ログイン成功時に裏でハッシュし直す")
+    print("\nレート制限: /token と /register はIPごとに20回/分、ユーザー名ごとに5回/分（超えると429）")
+    print("\nユーザー名のBloomフィルター: USERNAME_FILTER=1 で有効化（単一ワーカー向け、"
+          "USERNAME_FILTER_REFRESH_SECONDS=60 ごとに作り直す）")
+    print("\nユーザーの保存先: USER_DATABASE_URL=sqlite+aiosqlite:///./users.db などでDBを使用")
+    print("\nベンチマーク: python solution_03.py --bench")
+    print("テスト: python solution_03.py --test")
+    print("\nCPUプロファイリング（PROFILE_SAMPLE_RATE=0.01 などで起動した場合、ADMIN_USERNAMES の管理者のみ）:")
+    print("   X-Debug-Profile: <PROFILE_DEBUG_TOKEN の値> のリクエストは必ずプロファイル")
+    print("   GET /debug/profile/top        (サンプル数の多い関数)")
+    print("   GET /debug/profile/collapsed  (flame graph用のcollapsed stack形式)")
+    print("   PUT /debug/profile/config?sample_rate=0.05  (サンプリング率の変更)")
     print("\nサーバーを起動しています...")
 
     uvicorn.run(app, host="0.0.0.0", port=8000)